@@ -29,6 +29,8 @@ def main():
                 "delimiter":",",
                 "quotechar":"\"",
                 "orderby":"created",
+                "cache":True,
+                # "cache_invalidate":True,
                 # 'photo_id','owner','title','latitude','longitude','woeid','datetaken','tags','views'
                 "fields":[
                     {"id":"created",    "field":"date_taken",    "type":"datetime", "name":"Date Taken", "format":"%Y-%m-%d %H:%M:%S"},
@@ -7,11 +7,7 @@ from geo_qt import MapQt,MapDialog,GeojsonLayer,PointDataLayer,ModestMapLayer,Th
 
 def main():
 
-    debug = False
-    if debug:
-        filename = "venice_photos_2005_2014_sample.csv"
-    else:
-        filename = "venice_photos_2011_2014.csv"
+    filename = "venice_photos_2011_2014.csv"
 
     config_obj = {
             "layers":[
@@ -36,6 +32,8 @@ def main():
                 "delimiter":",",
                 "orderby":"created",
                 "quotechar":"\"",
+                # 5% of photos from each day for style previews, untick "Sampled data" for the final render
+                "sample":{"fraction":0.05, "seed":1, "stratify":"created"},
                 # 'photo_id','owner','title','latitude','longitude','woeid','datetaken','tags','views'
                 "fields":[
                     {"id":"title",      "field":"title",        "type":"string",    "name":"Text"},
@@ -6,6 +6,14 @@ from modestmap_layer import ModestMapLayer
 from utils import Utils, UTC
 from map_utils import MapUtils
 from geom import Rectangle
+from geometry import FlatGeometry, BoxIndex
+from geojson_loader import GeoJsonLoader
+from point_dataset import PointDataset
+from dataset_registry import DatasetRegistry
+from column_store import ColumnStore
+from sqlite_source import SQLiteSource
+from projection import ProjectionContext
+from projection_cache import ProjectionCache
 from basemap_layer import BasemapLayer
 
 
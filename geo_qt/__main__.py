@@ -0,0 +1,98 @@
+'''
+geo_qt command line tools
+
+Convert CSV/TSV files to a memory-mapped column store:
+
+python -m geo_qt convert <csv files> -o <store dir> --field lat:latitude:float --field lng:longitude:float
+python -m geo_qt convert --opts <layer opts json> -o <store dir>
+
+Convert to an indexed SQLite table for "datatype":"sqlite" layers:
+
+python -m geo_qt convert <csv files> -o <database file> --format sqlite --table <table> --field ...
+
+Fields are given as id:field:type or id:field:datetime:format, e.g.
+--field "created:date_taken:datetime:%Y-%m-%d %H:%M:%S"
+
+'''
+
+import argparse
+import json
+import sys
+
+from geo_qt.column_store import ColumnStore
+from geo_qt.loader_utils import LoaderUtils
+from geo_qt.sqlite_source import SQLiteSource
+from geo_qt.utils import Utils
+
+
+def parseField(fieldStr):
+    ''' id:field:type[:format] to loader field dict '''
+    parts = fieldStr.split(':',3)
+    if len(parts)<3:
+        raise argparse.ArgumentTypeError('Field "%s" is not id:field:type[:format]' % fieldStr)
+    fieldData = {'id':parts[0],'field':parts[1],'type':parts[2],'name':parts[0]}
+    if len(parts)==4:
+        fieldData['format'] = parts[3]
+    return fieldData
+
+
+def convert(args):
+    if args.opts:
+        with open(args.opts) as f:
+            params = json.load(f)
+        # JSON strings are unicode, the loader expects byte strings
+        params = Utils.byteify(params)
+    else:
+        if not args.files or not args.field:
+            print('convert needs CSV files and --field options, or --opts')
+            return 1
+        params = {
+            'path':'',
+            'files':args.files,
+            'delimiter':args.delimiter.decode('string_escape'),
+            'quotechar':args.quotechar,
+            'fields':args.field
+        }
+
+    if args.workers:
+        params['workers'] = args.workers
+    if args.bounds:
+        params['bounds'] = map(float,args.bounds.split(','))
+
+    if args.format=='sqlite':
+        if not args.table:
+            print('convert --format sqlite needs --table')
+            return 1
+        params['epoch_dates'] = True
+        dataset = LoaderUtils.loadCSV(params)
+        SQLiteSource.write(dataset,args.output,args.table,params['fields'])
+        return 0
+
+    dataset = LoaderUtils.loadCSV(params)
+    ColumnStore.write(dataset,args.output,params['fields'])
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='geo_qt',description='geo_qt data tools')
+    subparsers = parser.add_subparsers()
+
+    convertParser = subparsers.add_parser('convert',help='convert CSV/TSV files to a column store or SQLite table')
+    convertParser.add_argument('files',nargs='*',help='CSV/TSV files')
+    convertParser.add_argument('-o','--output',required=True,help='column store directory or SQLite database file')
+    convertParser.add_argument('--format',choices=['columns','sqlite'],default='columns',help='output format')
+    convertParser.add_argument('--table',help='SQLite table name')
+    convertParser.add_argument('--opts',help='JSON file of layer opts with path, files, delimiter, quotechar and fields')
+    convertParser.add_argument('--field',action='append',type=parseField,help='id:field:type[:format]')
+    convertParser.add_argument('--delimiter',default=',',help='field delimiter, e.g. "\\t"')
+    convertParser.add_argument('--quotechar',default='"')
+    convertParser.add_argument('--bounds',help='lng lat bounds l,b,r,t')
+    convertParser.add_argument('--workers',type=int,help='number of parser processes')
+    convertParser.set_defaults(func=convert)
+
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
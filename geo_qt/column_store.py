@@ -0,0 +1,144 @@
+'''
+Memory-mapped columnar store for point datasets
+
+A store is a directory holding one raw typed file per column and a JSON header:
+
+<name>/header.json
+{
+    "version":1,
+    "size":<number of rows>,
+    "columns":{
+        <id>:{"file":<id>.bin, "dtype":<numpy dtype str>, "type":<loader field type>}
+        string columns are a UTF-8 byte buffer with an int64 offsets file:
+        <id>:{"file":<id>.bin, "dtype":"|u1", "type":"string", "offsets_file":<id>.offsets.bin, "offsets_dtype":"<i8"}
+    },
+    "fields":<loader fields list used to create the store>
+}
+
+Columns are opened with numpy.memmap, so only the columns used by a layer are paged in
+and several processes reading the same store share pages.
+Datetime columns are stored as int64 epoch seconds, use the "epoch_dates" option to keep them memory-mapped.
+
+'''
+
+import json
+import os
+import time
+
+import numpy
+
+from geom import Rectangle
+from point_dataset import PointDataset, StringColumn
+
+HEADER_FILE = 'header.json'
+VERSION = 1
+
+
+class ColumnStore(object):
+
+    @staticmethod
+    def write(dataset,dirname,fields=None):
+        '''
+        Write dataset columns to store directory dirname
+        :param fields: loader fields list saved in the header
+        '''
+        t0 = time.time()
+        if not os.path.exists(dirname):
+            os.makedirs(dirname)
+
+        columns = {}
+        for id in dataset.columns:
+            if dataset.types[id]==None:
+                # derived columns such as projected coordinates and styles are not stored
+                continue
+            column = dataset.columns[id]
+            if isinstance(column,StringColumn):
+                array = numpy.ascontiguousarray(column.buffer)
+                offsets = numpy.ascontiguousarray(column.offsets-column.offsets[0])
+                offsetsFilename = id+'.offsets.bin'
+                offsets.tofile(os.path.join(dirname,offsetsFilename))
+            else:
+                array = numpy.ascontiguousarray(dataset.storageArray(id))
+                offsets = None
+            filename = id+'.bin'
+            array.tofile(os.path.join(dirname,filename))
+            columns[id] = {'file':filename,'dtype':array.dtype.str,'type':dataset.types[id]}
+            if offsets is not None:
+                columns[id]['offsets_file'] = offsetsFilename
+                columns[id]['offsets_dtype'] = offsets.dtype.str
+
+        header = {'version':VERSION,'size':len(dataset),'columns':columns,'fields':fields}
+        with open(os.path.join(dirname,HEADER_FILE),'w') as f:
+            json.dump(header,f,indent=4)
+
+        print ('ColumnStore write:', dirname, len(dataset), time.time()-t0)
+
+    @staticmethod
+    def open(dirname,ids=None,epochDates=False):
+        '''
+        Open store as a PointDataset of memory-mapped columns
+        :param ids: column ids to open, default all
+        :param epochDates: keep datetime columns as memory-mapped epoch seconds
+        '''
+        with open(os.path.join(dirname,HEADER_FILE)) as f:
+            header = json.load(f)
+
+        size = header['size']
+        dataset = PointDataset()
+        for id in header['columns']:
+            if ids!=None and not id in ids:
+                continue
+            column = header['columns'][id]
+            filename = os.path.join(dirname,column['file'])
+            if 'offsets_file' in column:
+                offsets = ColumnStore.mapArray(os.path.join(dirname,column['offsets_file']),column['offsets_dtype'],size+1)
+                buffer = ColumnStore.mapArray(filename,column['dtype'],int(offsets[-1]))
+                dataset.addColumn(str(id),StringColumn(buffer,offsets),column['type'])
+            else:
+                array = ColumnStore.mapArray(filename,column['dtype'],size)
+                array,type = PointDataset.fromStorageArray(array,column['type'],epochDates)
+                dataset.addColumn(str(id),array,type)
+        return dataset
+
+    @staticmethod
+    def mapArray(filename,dtype,size):
+        ''' Read-only memmap of size elements, numpy.memmap does not map empty files '''
+        dtype = numpy.dtype(str(dtype))
+        if size==0:
+            return numpy.zeros(0,dtype=dtype)
+        return numpy.memmap(filename,dtype=dtype,mode='r',shape=(size,))
+
+    @staticmethod
+    def load(params):
+        '''
+        Load layer dataset from stores, "datatype":"columns"
+        :param params: layer opts, "files" are store directories in "path"
+        '''
+        t0 = time.time()
+        ids = [fieldData['id'] for fieldData in params['fields']]
+        epochDates = params.get('epoch_dates',False)
+
+        datasets = []
+        for filename in params['files']:
+            dataset = ColumnStore.open(params['path']+filename,ids,epochDates)
+            missing = [id for id in ids if not dataset.hasColumn(id)]
+            if missing:
+                raise ValueError('Columns %s not in store %s' % (missing,filename))
+            datasets.append(dataset)
+
+        if len(datasets)==1:
+            dataset = datasets[0]
+        else:
+            # concatenation copies columns into memory
+            dataset = PointDataset.concat(datasets)
+
+        if 'bounds' in params:
+            l,b,r,t = params['bounds']
+            lng = dataset.column('lng')
+            lat = dataset.column('lat')
+            inBounds = (lng>=l) & (lng<=r) & (lat>=b) & (lat<=t)
+            if not inBounds.all():
+                dataset = dataset.subset(inBounds)
+
+        print ('ColumnStore load:', len(dataset), time.time()-t0)
+        return dataset
@@ -0,0 +1,76 @@
+'''
+Registry of datasets shared by map layers
+
+Layers that load the same source share one loaded and projected PointDataset.
+Each layer gets a view of the dataset for its own style and filter columns.
+
+'''
+
+import json
+
+
+class DatasetRegistry(object):
+    ''' Datasets keyed by source options, loaded once with the union of the fields of all layers '''
+
+    # layer options that change the loaded rows or their coordinates
+    SOURCE_KEYS = ('datatype','path','files','proj','delimiter','quotechar','bounds','epoch_dates','sample')
+
+    def __init__(self):
+        # source key -> union of fields lists
+        self.fields = {}
+        # source key -> PointDataset
+        self.datasets = {}
+
+    @staticmethod
+    def getKey(opts):
+        source = [opts.get(k) for k in DatasetRegistry.SOURCE_KEYS]
+        return json.dumps(source,sort_keys=True)
+
+    def registerLayers(self,layersOpts):
+        ''' Collect fields of all data layers in the map config before any layer loads '''
+        for opts in layersOpts:
+            if 'datatype' in opts and 'fields' in opts:
+                self.addFields(opts)
+
+    def addFields(self,opts):
+        '''
+        Add layer fields to the union of fields for the layer source
+        Fields are keyed on source column and id, so layers can load one column under different ids.
+        Raises ValueError for an id loaded from another column or with another type or format.
+        '''
+        key = DatasetRegistry.getKey(opts)
+        fields = self.fields.setdefault(key,[])
+        fieldsById = dict((fieldData['id'],fieldData) for fieldData in fields)
+        for fieldData in opts['fields']:
+            id = fieldData['id']
+            if not id in fieldsById:
+                fields.append(fieldData)
+                fieldsById[id] = fieldData
+                continue
+            other = fieldsById[id]
+            if other['field']!=fieldData['field']:
+                raise ValueError('Field "%s" loaded from columns "%s" and "%s"' % (id,other['field'],fieldData['field']))
+            if other['type']!=fieldData['type'] or other.get('format')!=fieldData.get('format'):
+                raise ValueError('Field "%s" of column "%s" loaded as %s and %s' % (id,fieldData['field'],other['type'],fieldData['type']))
+        return key
+
+    def getDataset(self,opts,loader):
+        '''
+        Return a view of the dataset for layer opts
+        :param loader: function loading a PointDataset from layer opts, e.g. LoaderUtils.loadCSV
+        '''
+        key = self.addFields(opts)
+        fields = self.fields[key]
+
+        dataset = self.datasets.get(key)
+        if dataset==None or any(not dataset.hasColumn(fieldData['id']) for fieldData in fields):
+            # load once with the union of fields
+            loadOpts = dict(opts)
+            loadOpts['fields'] = fields
+            dataset = loader(loadOpts)
+            self.datasets[key] = dataset
+
+        return dataset.view()
+
+    def clear(self):
+        self.datasets = {}
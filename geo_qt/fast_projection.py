@@ -0,0 +1,284 @@
+'''
+Closed-form NumPy transforms for common map projections
+
+Lng lat (EPSG:4326) to and from spherical Web Mercator (EPSG:3857) and
+Lambert Azimuthal Equal Area (+proj=laea, sphere or ellipsoid) are computed with
+vectorized formulas from Snyder, Map Projections: A Working Manual (1987).
+FastTransform.get returns None for other projection pairs, which are left to pyproj.
+
+Only Web Mercator is enabled by default, it is several times faster than pyproj.
+LAEA is no faster than pyproj and differs from it by up to 2.4e-5 m, pass
+projections=('merc','laea') to enable it.
+
+Accuracy against pyproj is checked by tests/test_fast_projection.py:
+
+python -m unittest discover tests
+
+and speed by tests/benchmark_fast_projection.py.
+
+'''
+
+import math
+
+import numpy
+
+# semi-major axis, inverse flattening
+ELLIPSOIDS = {
+    'WGS84':(6378137.0,298.257223563),
+    'GRS80':(6378137.0,298.257222101),
+    'sphere':(6370997.0,None)
+}
+
+WEB_MERCATOR_INITS = ('epsg:3857','epsg:900913','epsg:3785')
+
+LNGLAT_INITS = ('epsg:4326',)
+
+# "proj" names of the projections FastTransform.get uses by default
+DEFAULT_PROJECTIONS = ('merc',)
+
+
+def parseProj4(srs):
+    ''' proj4 string to dict of parameters, flags map to True '''
+    params = {}
+    for token in srs.split():
+        if token.startswith('+'):
+            key,sep,value = token[1:].partition('=')
+            params[key] = value if sep else True
+    return params
+
+
+def wrapLongitude(lam):
+    ''' Radians to the range [-pi,pi], as proj adjlon, values in range are unchanged '''
+    return lam-(2*math.pi)*numpy.round(lam/(2*math.pi))
+
+
+class FastTransform(object):
+
+    @staticmethod
+    def get(projSrc,projDest,projections=DEFAULT_PROJECTIONS):
+        '''
+        Vectorized transform function x,y -> px,py for supported Proj pairs, None otherwise
+        Points outside the projection domain are returned as nan
+        :param projections: enabled projections, "merc" and "laea"
+        '''
+        src = parseProj4(projSrc.srs)
+        dest = parseProj4(projDest.srs)
+        if FastTransform.isLngLat(src):
+            projection = FastTransform.getProjection(dest,projections)
+            if projection:
+                return projection.forward
+        elif FastTransform.isLngLat(dest):
+            projection = FastTransform.getProjection(src,projections)
+            if projection:
+                return projection.inverse
+        return None
+
+    @staticmethod
+    def hasDatumShift(params):
+        return any(key in params for key in ('towgs84','nadgrids','geoidgrids')) or params.get('datum','WGS84')!='WGS84'
+
+    @staticmethod
+    def isLngLat(params):
+        if 'init' in params:
+            return params['init'].lower() in LNGLAT_INITS and len(params)<=2
+        if not params.get('proj') in ('longlat','latlong','lonlat','latlon'):
+            return False
+        if FastTransform.hasDatumShift(params) or 'pm' in params:
+            return False
+        return params.get('ellps','WGS84') in ('WGS84','GRS80') and not 'a' in params and not 'R' in params
+
+    @staticmethod
+    def getEllipsoid(params):
+        ''' Semi-major axis and eccentricity squared, None for unsupported ellipsoid params '''
+        if 'R' in params:
+            return float(params['R']),0.0
+        if 'a' in params:
+            a = float(params['a'])
+            if 'b' in params:
+                b = float(params['b'])
+                return a,1-(b*b)/(a*a)
+            if 'rf' in params:
+                f = 1/float(params['rf'])
+                return a,2*f-f*f
+            return None
+        ellps = params.get('ellps','WGS84')
+        if not ellps in ELLIPSOIDS:
+            return None
+        a,rf = ELLIPSOIDS[ellps]
+        if rf==None:
+            return a,0.0
+        f = 1/rf
+        return a,2*f-f*f
+
+    @staticmethod
+    def getProjection(params,projections=DEFAULT_PROJECTIONS):
+        ''' WebMercator or LAEA object for proj4 params, None if not supported or not in projections '''
+        if 'init' in params:
+            if 'merc' in projections and params['init'].lower() in WEB_MERCATOR_INITS and len(params)<=2:
+                return WebMercator()
+            return None
+        if FastTransform.hasDatumShift(params) and params.get('nadgrids')!='@null':
+            return None
+        if params.get('units','m')!='m' or any(key in params for key in ('to_meter','pm','axis','over')):
+            return None
+
+        proj = params.get('proj')
+        if not proj in projections:
+            return None
+        if proj=='merc':
+            ellipsoid = FastTransform.getEllipsoid(params)
+            if ellipsoid==None or ellipsoid[1]!=0.0 or ellipsoid[0]!=6378137.0:
+                return None
+            defaults = (('lon_0',0),('lat_ts',0),('x_0',0),('y_0',0),('k',1),('k_0',1))
+            if any(float(params.get(key,value))!=value for key,value in defaults):
+                return None
+            return WebMercator()
+
+        if proj=='laea':
+            if FastTransform.hasDatumShift(params):
+                return None
+            ellipsoid = FastTransform.getEllipsoid(params)
+            if ellipsoid==None:
+                return None
+            a,es = ellipsoid
+            return LAEA(a,es,float(params.get('lat_0',0)),float(params.get('lon_0',0)),
+                        float(params.get('x_0',0)),float(params.get('y_0',0)))
+        return None
+
+
+class WebMercator(object):
+    ''' Spherical Web Mercator, EPSG:3857 '''
+    R = 6378137.0
+
+    def forward(self,lng,lat):
+        lng = numpy.asarray(lng,dtype=numpy.float64)
+        lat = numpy.asarray(lat,dtype=numpy.float64)
+        with numpy.errstate(invalid='ignore',divide='ignore'):
+            phi = numpy.radians(lat)
+            x = WebMercator.R*wrapLongitude(numpy.radians(lng))
+            y = WebMercator.R*numpy.log(numpy.tan(math.pi/4+phi/2))
+            # poles and beyond are outside the projection
+            invalid = ~(numpy.abs(lat)<90)
+        x[invalid] = numpy.nan
+        y[invalid] = numpy.nan
+        return x,y
+
+    def inverse(self,x,y):
+        x = numpy.asarray(x,dtype=numpy.float64)
+        y = numpy.asarray(y,dtype=numpy.float64)
+        lng = numpy.degrees(wrapLongitude(x/WebMercator.R))
+        lat = numpy.degrees(math.pi/2-2*numpy.arctan(numpy.exp(-y/WebMercator.R)))
+        return lng,lat
+
+
+class LAEA(object):
+    ''' Lambert Azimuthal Equal Area, polar, equatorial and oblique aspects on a sphere or ellipsoid '''
+    EPS = 1e-10
+
+    def __init__(self,a,es,lat0,lng0,x0=0.0,y0=0.0):
+        self.a = a
+        self.es = es
+        self.e = math.sqrt(es)
+        self.phi0 = math.radians(lat0)
+        self.lam0 = math.radians(lng0)
+        self.x0 = x0
+        self.y0 = y0
+        self.qp = self.q(1.0)
+        # radius of the authalic sphere
+        self.Rq = a*math.sqrt(self.qp/2)
+        if abs(abs(self.phi0)-math.pi/2)<LAEA.EPS:
+            self.mode = 'north' if self.phi0>0 else 'south'
+        else:
+            self.mode = 'oblique'
+            sinPhi0 = math.sin(self.phi0)
+            self.sinB1 = self.q(sinPhi0)/self.qp
+            self.cosB1 = math.sqrt(1-self.sinB1*self.sinB1)
+            m1 = math.cos(self.phi0)/math.sqrt(1-es*sinPhi0*sinPhi0)
+            self.D = a*m1/(self.Rq*self.cosB1)
+
+    def q(self,sinPhi):
+        ''' Snyder 3-12, sinPhi may be an array '''
+        if self.es==0.0:
+            return 2*sinPhi
+        e = self.e
+        esin = e*sinPhi
+        return (1-self.es)*(sinPhi/(1-esin*esin)-1/(2*e)*numpy.log((1-esin)/(1+esin)))
+
+    def authalicToGeodetic(self,beta):
+        ''' Snyder 3-18 series '''
+        es = self.es
+        if es==0.0:
+            return beta
+        es2 = es*es
+        es3 = es2*es
+        return (beta+(es/3+31*es2/180+517*es3/5040)*numpy.sin(2*beta)
+                +(23*es2/360+251*es3/3780)*numpy.sin(4*beta)
+                +(761*es3/45360)*numpy.sin(6*beta))
+
+    def forward(self,lng,lat):
+        lng = numpy.asarray(lng,dtype=numpy.float64)
+        lat = numpy.asarray(lat,dtype=numpy.float64)
+        with numpy.errstate(invalid='ignore',divide='ignore'):
+            lam = wrapLongitude(numpy.radians(lng)-self.lam0)
+            sinPhi = numpy.sin(numpy.radians(lat))
+            q = self.q(sinPhi)
+            if self.mode=='oblique':
+                sinB = numpy.clip(q/self.qp,-1,1)
+                cosB = numpy.sqrt(1-sinB*sinB)
+                cosLam = numpy.cos(lam)
+                denom = 1+self.sinB1*sinB+self.cosB1*cosB*cosLam
+                B = self.Rq*numpy.sqrt(2/denom)
+                x = B*self.D*cosB*numpy.sin(lam)
+                y = (B/self.D)*(self.cosB1*sinB-self.sinB1*cosB*cosLam)
+                # antipode of the centre
+                invalid = denom<LAEA.EPS
+            elif self.mode=='north':
+                rho = self.a*numpy.sqrt(numpy.maximum(self.qp-q,0))
+                x = rho*numpy.sin(lam)
+                y = -rho*numpy.cos(lam)
+                invalid = numpy.abs(self.qp+q)<LAEA.EPS
+            else:
+                rho = self.a*numpy.sqrt(numpy.maximum(self.qp+q,0))
+                x = rho*numpy.sin(lam)
+                y = rho*numpy.cos(lam)
+                invalid = numpy.abs(self.qp-q)<LAEA.EPS
+            invalid |= ~(numpy.abs(lat)<=90)
+        x = x+self.x0
+        y = y+self.y0
+        x[invalid] = numpy.nan
+        y[invalid] = numpy.nan
+        return x,y
+
+    def inverse(self,x,y):
+        x = numpy.asarray(x,dtype=numpy.float64)-self.x0
+        y = numpy.asarray(y,dtype=numpy.float64)-self.y0
+        with numpy.errstate(invalid='ignore',divide='ignore'):
+            if self.mode=='oblique':
+                D = self.D
+                rho = numpy.hypot(x/D,D*y)
+                sinC2 = rho/(2*self.Rq)
+                C = 2*numpy.arcsin(sinC2)
+                sinC = numpy.sin(C)
+                cosC = numpy.cos(C)
+                centre = rho<LAEA.EPS
+                rhoSafe = numpy.where(centre,1.0,rho)
+                sinB = numpy.where(centre,self.sinB1,cosC*self.sinB1+D*y*sinC*self.cosB1/rhoSafe)
+                lam = numpy.arctan2(x*sinC,D*rho*self.cosB1*cosC-D*D*y*self.sinB1*sinC)
+                lam = numpy.where(centre,0.0,lam)
+                invalid = ~(sinC2<=1)
+            else:
+                rho2 = (x*x+y*y)/(self.a*self.a)
+                if self.mode=='north':
+                    sinB = 1-rho2/self.qp
+                    lam = numpy.arctan2(x,-y)
+                else:
+                    sinB = rho2/self.qp-1
+                    lam = numpy.arctan2(x,y)
+                invalid = ~(numpy.abs(sinB)<=1)
+            beta = numpy.arcsin(numpy.clip(sinB,-1,1))
+            lat = numpy.degrees(self.authalicToGeodetic(beta))
+            lng = numpy.degrees(wrapLongitude(lam+self.lam0))
+        lng[invalid] = numpy.nan
+        lat[invalid] = numpy.nan
+        return lng,lat
+
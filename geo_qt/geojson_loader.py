@@ -0,0 +1,155 @@
+'''
+Streaming GeoJSON loader with a memory-mapped geometry cache
+
+Features of a FeatureCollection are decoded one at a time from the file and their coordinates
+appended to flat arrays, so the whole GeoJSON tree is never held in memory.
+
+Layer opts:
+{
+    "geojson":<GeoJSON file>,
+    "cache":<bool, save parsed geometry to a binary cache, default False>,
+    "cache_dir":<cache directory, default .geo_qt_cache/ next to the GeoJSON file>,
+    "cache_invalidate":<bool, reparse the GeoJSON file and overwrite the cache>
+}
+
+A cache is a directory holding one .npy file per FlatGeometry array and the feature
+properties as JSON. Arrays are opened with numpy.load mmap_mode, so vertices are paged in
+from the file when first used.
+
+'''
+
+import hashlib
+import json
+import os
+import shutil
+import time
+
+import numpy
+
+from geometry import FlatGeometry
+
+ARRAYS = ('x','y','ringOffsets','partOffsets','featureOffsets','closed')
+PROPERTIES_FILE = 'properties.json'
+VERSION = 1
+
+
+class GeoJsonLoader(object):
+
+    @staticmethod
+    def iterFeatures(filename,blockSize=1<<20):
+        '''
+        Decode the features of a GeoJSON FeatureCollection file one at a time
+        The file is read in blocks, a feature larger than a block is decoded once enough blocks are read
+        '''
+        decoder = json.JSONDecoder()
+        with open(filename,'rb') as f:
+            buf = ''
+            pos = -1
+            eof = False
+            # start of the features array
+            while pos<0:
+                if eof:
+                    raise ValueError('No features array in GeoJSON file: '+filename)
+                block = f.read(blockSize)
+                eof = not block
+                buf += block
+                key = buf.find('"features"')
+                if key>=0:
+                    pos = buf.find('[',key)
+
+            pos += 1
+            readSize = blockSize
+            while True:
+                # skip whitespace and separators between features
+                while pos<len(buf) and buf[pos] in ' \t\r\n,':
+                    pos += 1
+                if pos<len(buf) and buf[pos]==']':
+                    return
+                end = None
+                if pos<len(buf):
+                    try:
+                        feature,end = decoder.raw_decode(buf,pos)
+                    except ValueError:
+                        pass
+                if end==None:
+                    if eof:
+                        raise ValueError('Invalid or truncated GeoJSON file: '+filename)
+                    # drop decoded features, read more for an incomplete feature
+                    buf = buf[pos:]
+                    pos = 0
+                    block = f.read(readSize)
+                    eof = not block
+                    buf += block
+                    # grow reads so a large feature is not decoded once per block
+                    readSize = max(blockSize,len(buf))
+                    continue
+                readSize = blockSize
+                pos = end
+                yield feature
+
+    @staticmethod
+    def parse(filename):
+        ''' FlatGeometry of a GeoJSON file, decoded feature by feature '''
+        t0 = time.time()
+        geometry = FlatGeometry.fromFeatures(GeoJsonLoader.iterFeatures(filename))
+        print ('GeoJsonLoader parse:', geometry.featureCount(), geometry.vertexCount(), time.time()-t0, filename)
+        return geometry
+
+    @staticmethod
+    def load(params):
+        ''' FlatGeometry of layer opts "geojson", from the cache if enabled '''
+        filename = params['geojson']
+        if not params.get('cache',False):
+            return GeoJsonLoader.parse(filename)
+
+        cacheDir = GeoJsonLoader.getCacheDirname(params)
+        if os.path.exists(cacheDir) and not params.get('cache_invalidate',False):
+            t0 = time.time()
+            geometry = GeoJsonLoader.open(cacheDir)
+            print ('GeoJsonLoader cache:', time.time()-t0, cacheDir)
+            return geometry
+
+        geometry = GeoJsonLoader.parse(filename)
+        try:
+            GeoJsonLoader.save(geometry,cacheDir)
+        except (IOError,OSError) as e:
+            print('GeoJsonLoader cache not saved:',e)
+        return geometry
+
+    @staticmethod
+    def getCacheDirname(params):
+        ''' Cache directory keyed on the GeoJSON file path, mtime and size '''
+        file = os.path.abspath(params['geojson'])
+        cacheDir = params.get('cache_dir',os.path.join(os.path.dirname(file),'.geo_qt_cache'))
+        stat = os.stat(file)
+        keyStr = json.dumps({'geojson':[file,stat.st_mtime,stat.st_size],'version':VERSION},sort_keys=True)
+        return os.path.join(cacheDir,hashlib.sha1(keyStr).hexdigest()+'.geojson')
+
+    @staticmethod
+    def save(geometry,dirname):
+        ''' Write geometry arrays and properties to cache directory dirname '''
+        t0 = time.time()
+        # write to temporary directory so an interrupted save leaves no partial cache
+        tmpDirname = dirname+'.tmp'
+        if os.path.exists(tmpDirname):
+            shutil.rmtree(tmpDirname)
+        os.makedirs(tmpDirname)
+        for name in ARRAYS:
+            numpy.save(os.path.join(tmpDirname,name+'.npy'),getattr(geometry,name))
+        with open(os.path.join(tmpDirname,PROPERTIES_FILE),'w') as f:
+            json.dump(geometry.properties,f)
+        if os.path.exists(dirname):
+            shutil.rmtree(dirname)
+        os.rename(tmpDirname,dirname)
+        print ('GeoJsonLoader save:', time.time()-t0, dirname)
+
+    @staticmethod
+    def open(dirname):
+        ''' FlatGeometry of memory-mapped cache arrays '''
+        arrays = {}
+        for name in ARRAYS:
+            arrays[name] = numpy.load(os.path.join(dirname,name+'.npy'),mmap_mode='r')
+        with open(os.path.join(dirname,PROPERTIES_FILE)) as f:
+            properties = json.load(f)
+        return FlatGeometry(arrays['x'],arrays['y'],arrays['ringOffsets'],arrays['partOffsets'],
+                            arrays['featureOffsets'],arrays['closed'],properties)
@@ -0,0 +1,275 @@
+'''
+Flat coordinate array geometry
+
+FlatGeometry stores the vertices of all GeoJSON features in two float64 arrays.
+Offset arrays give the vertices of each ring, the rings of each part and the parts of each feature:
+
+ring r:     x[ringOffsets[r]:ringOffsets[r+1]]
+part p:     rings partOffsets[p] to partOffsets[p+1]
+feature f:  parts featureOffsets[f] to featureOffsets[f+1]
+
+Polygon parts are an outer ring followed by hole rings, line parts have one ring.
+
+significance gives the Douglas-Peucker tolerance at which each projected vertex is dropped,
+so a simplified geometry for any tolerance is a vertex mask, see simplifiedRings.
+
+BoxIndex is a uniform grid over the projected feature bounding boxes, to find the features
+that intersect the view.
+
+'''
+
+from array import array
+
+import numpy
+
+# GeoJSON geometry types as lists of parts, each part a list of rings
+PART_TYPES = {
+    'Polygon':lambda coords: [coords],
+    'MultiPolygon':lambda coords: coords,
+    'LineString':lambda coords: [[coords]],
+    'MultiLineString':lambda coords: [[line] for line in coords]
+}
+
+POLYGON_TYPES = ('Polygon','MultiPolygon')
+
+# min vertices of a simplified closed ring, 3 distinct vertices and the closing vertex
+CLOSED_RING_VERTICES = 4
+
+
+class FlatGeometry(object):
+    ''' Features as flat vertex arrays with ring, part and feature offsets '''
+
+    def __init__(self,x,y,ringOffsets,partOffsets,featureOffsets,closed,properties):
+        # float64 vertex coords
+        self.x = x
+        self.y = y
+        # int64 offset arrays, length n+1
+        self.ringOffsets = ringOffsets
+        self.partOffsets = partOffsets
+        self.featureOffsets = featureOffsets
+        # bool per feature, True for polygons drawn as closed filled rings
+        self.closed = closed
+        # properties dict per feature
+        self.properties = properties
+
+    @staticmethod
+    def fromGeojson(geojson):
+        ''' Convert a GeoJSON FeatureCollection dict '''
+        return FlatGeometry.fromFeatures(geojson['features'])
+
+    @staticmethod
+    def fromFeatures(features):
+        '''
+        Convert an iterable of GeoJSON feature dicts
+        Point and GeometryCollection geometries are stored as features without parts
+        Coordinates are appended to typed arrays, so features can be streamed without a list per vertex
+        '''
+        x = array('d')
+        y = array('d')
+        ringOffsets = [0]
+        partOffsets = [0]
+        featureOffsets = [0]
+        closed = []
+        properties = []
+
+        for feature in features:
+            geometry = feature.get('geometry')
+            geomType = geometry['type'] if geometry else None
+            if geomType in PART_TYPES:
+                for part in PART_TYPES[geomType](geometry['coordinates']):
+                    for ring in part:
+                        x.extend(p[0] for p in ring)
+                        y.extend(p[1] for p in ring)
+                        ringOffsets.append(len(x))
+                    partOffsets.append(len(ringOffsets)-1)
+            featureOffsets.append(len(partOffsets)-1)
+            closed.append(geomType in POLYGON_TYPES)
+            properties.append(feature.get('properties'))
+
+        return FlatGeometry(numpy.frombuffer(x,dtype=numpy.float64),numpy.frombuffer(y,dtype=numpy.float64),
+                            numpy.array(ringOffsets,dtype=numpy.int64),numpy.array(partOffsets,dtype=numpy.int64),
+                            numpy.array(featureOffsets,dtype=numpy.int64),numpy.array(closed,dtype=bool),properties)
+
+    def featureCount(self):
+        return len(self.featureOffsets)-1
+
+    def ringCount(self):
+        return len(self.ringOffsets)-1
+
+    def vertexCount(self):
+        return len(self.x)
+
+    def ringValid(self,px):
+        '''
+        Bool per ring, False if any projected vertex is nan
+        :param px: projected x array of the vertices
+        '''
+        invalid = numpy.isnan(px).astype(numpy.int64)
+        # number of nan vertices before each ring offset
+        counts = numpy.concatenate(([0],numpy.cumsum(invalid)))[self.ringOffsets]
+        return numpy.diff(counts)==0
+
+    def significance(self,px,py):
+        '''
+        Douglas-Peucker significance of each vertex in projected units
+        A vertex is kept when simplifying with tolerance t if its significance is > t,
+        ring end points are always kept. Segments of all rings are split together,
+        one vectorized pass over the vertices per level of the split tree.
+        '''
+        n = len(px)
+        sig = numpy.zeros(n)
+        if n==0:
+            return sig
+        kept = numpy.zeros(n,dtype=bool)
+        ends = numpy.concatenate((self.ringOffsets[:-1],self.ringOffsets[1:]-1))
+        ends = ends[(ends>=0) & (ends<n)]
+        kept[ends] = True
+        sig[ends] = numpy.inf
+        # vertices of runs between kept vertices that may still be split, with the run end points
+        active = numpy.arange(n)
+
+        with numpy.errstate(invalid='ignore',divide='ignore'):
+            while len(active):
+                x = px[active]
+                y = py[active]
+                k = kept[active]
+                pos = numpy.arange(len(active))
+                # positions of the kept vertices before and after each vertex
+                left = numpy.maximum.accumulate(numpy.where(k,pos,0))
+                right = numpy.minimum.accumulate(numpy.where(k,pos,len(pos)-1)[::-1])[::-1]
+                # distance to the segment between left and right
+                ax = x[left]
+                ay = y[left]
+                dx = x[right]-ax
+                dy = y[right]-ay
+                length2 = dx*dx+dy*dy
+                t = numpy.clip(((x-ax)*dx+(y-ay)*dy)/length2,0,1)
+                t[length2==0] = 0
+                dist = numpy.hypot(x-ax-t*dx,y-ay-t*dy)
+                # nan vertices are dropped, their rings are not drawn
+                dist[k | ~(dist>0)] = 0
+
+                # farthest vertex in each run
+                starts = numpy.flatnonzero(k)
+                runMax = numpy.repeat(numpy.maximum.reduceat(dist,starts),numpy.diff(numpy.append(starts,len(pos))))
+                candidates = numpy.flatnonzero((dist>0) & (dist==runMax))
+                if len(candidates)==0:
+                    break
+                # first farthest vertex of each run
+                runs = left[candidates]
+                split = candidates[numpy.concatenate(([True],runs[1:]!=runs[:-1]))]
+
+                # split vertices are never more significant than the segment end points
+                sig[active[split]] = numpy.minimum(dist[split],numpy.minimum(sig[active[left[split]]],sig[active[right[split]]]))
+                kept[active[split]] = True
+
+                # drop runs with no vertex off the segment
+                retain = runMax>0
+                retain[right[retain]] = True
+                active = active[retain]
+        return sig
+
+    def featureBounds(self,px,py):
+        '''
+        Bounding box of the projected vertices of each feature, nan vertices are ignored
+        :return: float64 array of l,b,r,t rows, nan for features without projected vertices
+        '''
+        bounds = numpy.full((self.featureCount(),4),numpy.nan)
+        # first vertex of each feature
+        starts = self.ringOffsets[self.partOffsets[self.featureOffsets]]
+        nonEmpty = numpy.flatnonzero(numpy.diff(starts)>0)
+        if len(nonEmpty)==0:
+            return bounds
+        # reduceat ranges run to the next start, empty features are skipped
+        starts = starts[nonEmpty]
+        with numpy.errstate(invalid='ignore'):
+            bounds[nonEmpty,0] = numpy.fmin.reduceat(px,starts)
+            bounds[nonEmpty,1] = numpy.fmin.reduceat(py,starts)
+            bounds[nonEmpty,2] = numpy.fmax.reduceat(px,starts)
+            bounds[nonEmpty,3] = numpy.fmax.reduceat(py,starts)
+        return bounds
+
+    def ringClosed(self):
+        ''' bool per ring, True for rings of closed features '''
+        partFeatures = numpy.repeat(numpy.arange(self.featureCount()),numpy.diff(self.featureOffsets))
+        ringParts = numpy.repeat(numpy.arange(len(self.partOffsets)-1),numpy.diff(self.partOffsets))
+        return numpy.asarray(self.closed,dtype=bool)[partFeatures[ringParts]]
+
+    def simplifiedRings(self,significance,tolerance):
+        '''
+        Vertex indices and ring offsets of the vertices with significance > tolerance
+        Closed rings keep at least their CLOSED_RING_VERTICES most significant vertices, 3 distinct
+        vertices and the closing vertex, so simplification never removes a polygon
+        :return: index array, int64 ring offsets into the index array
+        '''
+        keep = significance>tolerance
+        counts = numpy.concatenate(([0],numpy.cumsum(keep)))
+        sizes = numpy.diff(self.ringOffsets)
+        kept = numpy.diff(counts[self.ringOffsets])
+        short = numpy.flatnonzero(self.ringClosed() & (kept<CLOSED_RING_VERTICES) & (kept<sizes))
+        if len(short):
+            # vertices of short rings sorted by ring, then by descending significance
+            lengths = sizes[short]
+            groupStarts = numpy.concatenate(([0],numpy.cumsum(lengths)[:-1]))
+            rings = numpy.repeat(numpy.arange(len(short)),lengths)
+            vertices = numpy.arange(lengths.sum())+numpy.repeat(self.ringOffsets[short]-groupStarts,lengths)
+            order = numpy.lexsort((-significance[vertices],rings))
+            rank = numpy.arange(len(vertices))-numpy.repeat(groupStarts,lengths)
+            keep[vertices[order[rank<CLOSED_RING_VERTICES]]] = True
+            counts = numpy.concatenate(([0],numpy.cumsum(keep)))
+        return numpy.flatnonzero(keep),counts[self.ringOffsets]
+
+
+class BoxIndex(object):
+    '''
+    Uniform grid index of bounding boxes
+    Each box is listed in every grid cell it overlaps, cell lists are stored in one array
+    sorted by cell, so a query reads one contiguous slice per grid row.
+    '''
+
+    def __init__(self,bounds,cells=None):
+        '''
+        :param bounds: array of l,b,r,t rows, rows with nan are never returned
+        :param cells: grid cells per side, default about one box per cell
+        '''
+        self.bounds = numpy.asarray(bounds,dtype=numpy.float64).reshape(-1,4)
+        valid = numpy.flatnonzero(numpy.isfinite(self.bounds).all(axis=1))
+        self.count = len(valid)
+        if self.count==0:
+            return
+        b = self.bounds[valid]
+        self.extent = [b[:,0].min(),b[:,1].min(),b[:,2].max(),b[:,3].max()]
+        self.cells = cells or int(min(max(numpy.sqrt(self.count),1),256))
+        # cell ranges of each box
+        i0,j0 = self.getCell(b[:,0],b[:,1])
+        i1,j1 = self.getCell(b[:,2],b[:,3])
+        w = i1-i0+1
+        counts = w*(j1-j0+1)
+        # every (box,cell) pair, enumerated per box
+        box = numpy.repeat(numpy.arange(self.count),counts)
+        k = numpy.arange(counts.sum())-numpy.repeat(numpy.cumsum(counts)-counts,counts)
+        cell = (j0[box]+k//w[box])*self.cells+i0[box]+k%w[box]
+        order = numpy.argsort(cell,kind='mergesort')
+        self.ids = valid[box[order]]
+        # ids of cell c are ids[cellStarts[c]:cellStarts[c+1]]
+        self.cellStarts = numpy.searchsorted(cell[order],numpy.arange(self.cells*self.cells+1))
+
+    def getCell(self,x,y):
+        ''' Grid column and row of points, clamped to the grid '''
+        sx = self.cells/max(self.extent[2]-self.extent[0],1e-300)
+        sy = self.cells/max(self.extent[3]-self.extent[1],1e-300)
+        i = numpy.clip(numpy.floor((numpy.asarray(x)-self.extent[0])*sx),0,self.cells-1).astype(numpy.int64)
+        j = numpy.clip(numpy.floor((numpy.asarray(y)-self.extent[1])*sy),0,self.cells-1).astype(numpy.int64)
+        return i,j
+
+    def query(self,rect):
+        ''' Sorted ids of the boxes intersecting rect l,b,r,t '''
+        l,b,r,t = rect
+        if self.count==0 or r<self.extent[0] or l>self.extent[2] or t<self.extent[1] or b>self.extent[3]:
+            return numpy.zeros(0,dtype=numpy.int64)
+        i0,j0 = self.getCell(l,b)
+        i1,j1 = self.getCell(r,t)
+        ids = numpy.unique(numpy.concatenate([self.ids[self.cellStarts[j*self.cells+i0]:self.cellStarts[j*self.cells+i1+1]]
+                                              for j in range(int(j0),int(j1)+1)]))
+        boxes = self.bounds[ids]
+        return ids[(boxes[:,0]<=r) & (boxes[:,2]>=l) & (boxes[:,1]<=t) & (boxes[:,3]>=b)]
@@ -2,100 +2,563 @@
 Data loading utilities
 '''
 
+import bz2
 import csv
+import gzip
+import hashlib
+import itertools
+import json
+import multiprocessing
+import os
+import random
+import threading
 import time
+from cStringIO import StringIO
+from operator import itemgetter
+from Queue import Queue, Empty, Full
+
+try:
+    import lzma
+except ImportError:
+    try:
+        from backports import lzma
+    except ImportError:
+        # .xz files need Python 3 or backports.lzma
+        lzma = None
 
 from utils import *
 from geom import Rectangle
+from point_dataset import PointDataset
+
+# Field types converted a column at a time to epoch seconds
+DATE_TYPES = ('datetime','timestamp')
+
+class DecompressReader(object):
+    '''
+    Line reader over a .gz, .bz2 or .xz file.
+    A background thread reads and decompresses blocks into a bounded queue
+    while the caller parses lines, zlib, bz2 and lzma release the GIL while decompressing.
+    '''
+    OPENERS = {
+        '.gz':gzip.open,
+        '.bz2':bz2.BZ2File
+    }
+
+    def __init__(self,file,blockSize=1<<20,queueSize=8):
+        ext = os.path.splitext(file)[1].lower()
+        if ext=='.xz':
+            if lzma==None:
+                raise ValueError('Reading .xz files requires the lzma module: '+file)
+            opener = lzma.open
+        else:
+            opener = DecompressReader.OPENERS[ext]
+
+        self.blocks = Queue(queueSize)
+        self.stopped = False
+        self.thread = threading.Thread(target=self.readBlocks,args=(opener,file,blockSize))
+        self.thread.daemon = True
+        self.thread.start()
+        self.lines = self.iterLines()
+
+    @staticmethod
+    def isCompressed(file):
+        ext = os.path.splitext(file)[1].lower()
+        return ext in DecompressReader.OPENERS or ext=='.xz'
+
+    def readBlocks(self,opener,file,blockSize):
+        ''' Reader thread, queues decompressed blocks then None, or the exception raised '''
+        try:
+            f = opener(file,'rb')
+            try:
+                while not self.stopped:
+                    block = f.read(blockSize)
+                    if not block:
+                        break
+                    self.putBlock(block)
+            finally:
+                f.close()
+            self.putBlock(None)
+        except Exception as e:
+            self.putBlock(e)
+
+    def putBlock(self,block):
+        while not self.stopped:
+            try:
+                self.blocks.put(block,timeout=0.1)
+                return
+            except Full:
+                pass
+
+    def iterLines(self):
+        remainder = ''
+        while True:
+            block = self.blocks.get()
+            if block is None:
+                break
+            if isinstance(block,Exception):
+                raise block
+            data = remainder+block
+            idx = data.rfind('\n')
+            if idx==-1:
+                remainder = data
+                continue
+            remainder = data[idx+1:]
+            for line in StringIO(data[:idx+1]):
+                yield line
+        if remainder:
+            yield remainder
+
+    def readline(self):
+        return next(self.lines,'')
+
+    def __iter__(self):
+        return self.lines
+
+    def close(self):
+        self.stopped = True
+        # unblock the reader thread if it is waiting on a full queue
+        try:
+            while True:
+                self.blocks.get_nowait()
+        except Empty:
+            pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,*args):
+        self.close()
+
+
+class RowSampler(object):
+    '''
+    Single pass row sampling, "sample":{"fraction":<0-1>, "seed":<int>, "stratify":<field id>}
+    Without stratify each row is kept with probability fraction.
+    With stratify rows are kept systematically within each stratum from a random start,
+    so every stratum keeps its share of rows. Date fields are stratified by day.
+    Rejected rows are not converted.
+    '''
+    def __init__(self,sampleOpts,params,header,chunk=None):
+        self.fraction = float(sampleOpts['fraction'])
+        # seeded per file chunk, the same opts and chunks select the same rows
+        self.random = random.Random('%s:%s' % (sampleOpts.get('seed',1),chunk))
+        self.getKey = None
+        # stratum key -> [rows seen, start offset]
+        self.strata = {}
+        if 'stratify' in sampleOpts:
+            fieldsById = dict((fieldData['id'],fieldData) for fieldData in params['fields'])
+            fieldData = fieldsById[sampleOpts['stratify']]
+            if not fieldData['field'] in header:
+                raise ValueError('CSV field "%s" not in header' % fieldData['field'])
+            self.getKey = RowSampler.getKeyFunction(fieldData,header.index(fieldData['field']))
+
+    @staticmethod
+    def getKeyFunction(fieldData,idx):
+        ''' Function returning the stratum key of a row, dates are truncated to days '''
+        if fieldData['type']=='timestamp':
+            return lambda row: int(float(row[idx] or 0))//86400
+        if fieldData['type']=='datetime':
+            layout = Utils.fixedFormatLayout(fieldData['format'])
+            if layout:
+                slices = [(start,start+width) for directive,start,width in layout[0] if directive in 'Ymd']
+                return lambda row: tuple(row[idx][start:end] for start,end in slices)
+            format = fieldData['format']
+            return lambda row: datetime.strptime(row[idx],format).date() if row[idx] else None
+        return lambda row: row[idx]
+
+    def keep(self,row):
+        if self.getKey==None:
+            return self.random.random()<self.fraction
+        key = self.getKey(row)
+        stratum = self.strata.get(key)
+        if stratum==None:
+            stratum = self.strata[key] = [0,self.random.random()]
+        n = stratum[0]
+        stratum[0] += 1
+        # keep the row when the running sample count passes an integer
+        return int(n*self.fraction+stratum[1])<int((n+1)*self.fraction+stratum[1])
+
+
+class CSVRowParser(object):
+    '''
+    Converts CSV rows to column lists.
+    Header indices are resolved once, only the configured fields are converted
+    and lng,lat are tested against params['bounds'] before any other field.
+    '''
+    def __init__(self,params,header,chunk=None):
+        self.params = params
+        self.bounds = None
+        if 'bounds' in params:
+            self.bounds = Rectangle()
+            self.bounds.fromList(params['bounds'])
+
+        # one field per CSV column and id, a column can be loaded under several ids
+        self.fields = []
+        keys = set()
+        for fieldData in params['fields']:
+            key = (fieldData['field'],fieldData['id'])
+            if not key in keys:
+                keys.add(key)
+                self.fields.append(fieldData)
+        self.converters = [LoaderUtils.getConverter(fieldData) for fieldData in self.fields]
+
+        # one list per column, converted to numpy arrays by createDataset
+        self.lists = {}
+        for fieldData in self.fields:
+            self.lists[fieldData['id']] = []
+
+        self.nSkipped = 0
+        self.setHeader(header)
+
+        self.sampler = None
+        if 'sample' in params:
+            self.sampler = RowSampler(params['sample'],params,header,chunk)
+
+    def setHeader(self,header):
+        ''' Resolve column indices of fields from CSV header '''
+        self.header = header
+        indices = []
+        for fieldData in self.fields:
+            if not fieldData['field'] in header:
+                raise ValueError('CSV field "%s" not in header' % fieldData['field'])
+            indices.append(header.index(fieldData['field']))
+
+        if len(indices)==1:
+            idx = indices[0]
+            self.getValues = lambda row: (row[idx],)
+        else:
+            self.getValues = itemgetter(*indices)
+        self.rowLength = max(indices)+1
+
+        self.lngIdx = None
+        self.latIdx = None
+        if self.bounds:
+            idMap = dict((fieldData['id'],i) for i,fieldData in enumerate(self.fields))
+            self.lngIdx = indices[idMap['lng']]
+            self.latIdx = indices[idMap['lat']]
+            self.lngConverter = self.converters[idMap['lng']]
+            self.latConverter = self.converters[idMap['lat']]
+
+    def parseRows(self,rows):
+        '''
+        Append converted values of rows within bounds
+        :return: number of rows read
+        '''
+        nRows = 0
+        appends = [self.lists[fieldData['id']].append for fieldData in self.fields]
+        converters = self.converters
+        items = list(zip(appends,converters))
+        getValues = self.getValues
+        rowLength = self.rowLength
+        sampler = self.sampler
+
+        bounds = self.bounds
+        if bounds:
+            l,b,r,t = bounds.toList()
+            lngIdx = self.lngIdx
+            latIdx = self.latIdx
+            lngConverter = self.lngConverter
+            latConverter = self.latConverter
+
+        for row in rows:
+            nRows += 1
+            if len(row)<rowLength:
+                # blank or truncated line
+                self.nSkipped += 1
+                continue
+
+            if bounds:
+                lng = lngConverter(row[lngIdx])
+                lat = latConverter(row[latIdx])
+                if lng<l or lng>r or lat<b or lat>t:
+                    continue
+
+            if sampler and not sampler.keep(row):
+                continue
+
+            values = getValues(row)
+            for i in range(0,len(values)):
+                append,converter = items[i]
+                append(converter(values[i]))
+
+        return nRows
+
+    def createDataset(self):
+        ''' Create PointDataset from parsed rows and clear the column lists '''
+        dataset = LoaderUtils.createDataset(self.fields,self.lists,self.params.get('epoch_dates',False))
+        for id in self.lists:
+            self.lists[id] = []
+        return dataset
 
-class DataItem(object):
-    def __init__(self):
-        self.id = ''
-        self.lng = 0.0
-        self.lat = 0.0
 
 class LoaderUtils(object):
     @staticmethod
     def loadCSV(params):
         '''
+        Load CSV files into a columnar PointDataset
         :param params:
         {
             "path":<path>,
-            "files":[<filename>],
+            "files":[<filename, .gz, .bz2 and .xz files are decompressed while parsing>],
             "delimiter":<str>,
             "quotechar":<str>,
             "fields":[
-                {"id":<property of DataItem>,    "field":<filed in CSV>,  "type":<data type>,    "name":<name>},
-            ]
+                {"id":<column id in the dataset>,    "field":<filed in CSV>,  "type":<data type>,    "name":<name>},
+            ],
+            "cache":<bool, save parsed dataset to binary cache, default False>,
+            "cache_dir":<cache directory, default <path>/.geo_qt_cache/>,
+            "cache_invalidate":<bool, reparse CSV files and overwrite cache>,
+            "epoch_dates":<bool, keep datetime and timestamp fields as int64 epoch seconds>,
+            "workers":<number of processes used to parse files, default 1>,
+            "chunk_mb":<split files larger than chunk_mb into byte ranges parsed by separate workers, not compressed files>,
+            "sample":<{"fraction":<0-1>,"seed":<int>,"stratify":<field id>}, load a sample of rows, see RowSampler>
         }
         '''
+        cacheFile = None
+        if params.get('cache',False):
+            cacheFile = LoaderUtils.getCacheFilename(params)
+            if os.path.exists(cacheFile) and not params.get('cache_invalidate',False):
+                start = time.time()
+                dataset = PointDataset.load(cacheFile)
+                print ('CSVLoader cache:', time.time()-start, cacheFile)
+                return dataset
 
-        items = []
-        itemId = 0
+        dataset = LoaderUtils.parseCSV(params)
 
-        bounds = None
-        if 'bounds' in params:
-            bounds = Rectangle()
-            bounds.fromList(params['bounds'])
+        if cacheFile:
+            LoaderUtils.saveCache(dataset,cacheFile)
 
+        return dataset
 
-        fieldsParam = params['fields']
-        fields = {}
-        for fieldData in fieldsParam:
-            fields[fieldData['field']] = fieldData
+    @staticmethod
+    def parseCSV(params):
+        ''' Parse CSV files listed in params into a PointDataset '''
 
         start = time.time()
-        for filename in params["files"]:
-            file = params["path"]+filename
-            with open(file, 'rb') as csvfile:
-                reader = csv.DictReader(csvfile, delimiter=params['delimiter'], quotechar=params['quotechar'],escapechar='\\')
-                for row in reader:
-                    item = DataItem()
-                    for field in fields:
-                        fieldData = fields[field]
-                        id = fieldData['id']
-                        type = fieldData['type']
-                        val = row[field]
-
-                        if type=='string':
-                            value = val
-
-                        elif type=='int':
-                            if val =='' or val == 'NULL':
-                                value = 0
-                            else:
-                                value = int(val)
-                        elif type=='float':
-                            if val =='' or val == 'NULL':
-                                value = 0.0
-                            else:
-                                value = float(val)
-                        elif type=='datetime':
-                            if val=='' or val=='0':
-                                value = datetime.now()
-                            else:
-                                value = Utils.str2utc(val,fieldData['format'])
-                        elif type=='timestamp':
-                            if val=='':
-                                value = datetime.now()
-                            else:
-                                value = Utils.timestamp2utc(float(val))
-                        else:
-                            value = val
-
-                        setattr(item, id, value)
-
-                    if bounds==None or bounds.within(item.lng,item.lat):
-                        items.append(item)
-
-
-                itemId += 1
+
+        tasks = LoaderUtils.getChunks(params)
+        workers = min(params.get('workers',1),len(tasks))
+        if workers>1:
+            pool = multiprocessing.Pool(workers)
+            try:
+                # map returns results in task order
+                results = pool.map(loadCSVChunk,[(params,task) for task in tasks])
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            results = [LoaderUtils.loadChunk(params,task) for task in tasks]
+
+        dataset = PointDataset.concat([result[0] for result in results])
+
+        # per-file timing, summed over file chunks
+        timings = []
+        for task,result in zip(tasks,results):
+            if task[1]==0:
+                # first chunk of file
+                timings.append({'file':task[0],'secs':0.0,'rows':0,'chunks':0})
+            timings[-1]['secs'] += result[1]
+            timings[-1]['rows'] += len(result[0])
+            timings[-1]['chunks'] += 1
+        dataset.timings = timings
 
         end = time.time()
+        for timing in timings:
+            print ('CSVLoader file:', timing['file'], timing['rows'], timing['secs'])
         print ('CSVLoader:', end-start)
-        return items
+        return dataset
+
+    @staticmethod
+    def getChunks(params):
+        '''
+        Split files into (filename,start,end) byte ranges.
+        Files larger than params['chunk_mb'] are split at line boundaries,
+        only use with files that have no line breaks in quoted fields.
+        '''
+        chunks = []
+        chunkBytes = None
+        if 'chunk_mb' in params:
+            chunkBytes = int(params['chunk_mb']*1024*1024)
+
+        for filename in params['files']:
+            size = os.path.getsize(params['path']+filename)
+            # compressed files can only be read from the start
+            if chunkBytes and size>chunkBytes and not DecompressReader.isCompressed(filename):
+                for start in range(0,size,chunkBytes):
+                    chunks.append((filename,start,min(start+chunkBytes,size)))
+            else:
+                chunks.append((filename,0,None))
+        return chunks
+
+    @staticmethod
+    def loadChunk(params,chunk):
+        '''
+        Parse the rows of a file chunk that start within its byte range
+        :return: PointDataset, seconds
+        '''
+        t0 = time.time()
+        filename,start,end = chunk
+        file = params["path"]+filename
+        with LoaderUtils.openFile(file) as csvfile:
+            # header read with readline, file iteration would prevent later readline calls
+            header = next(LoaderUtils.csvReader([csvfile.readline()],params))
+            parser = CSVRowParser(params,header,chunk)
+            if end==None:
+                reader = LoaderUtils.csvReader(csvfile,params)
+            else:
+                if start>0:
+                    # skip to the first line starting at or after start
+                    csvfile.seek(start-1)
+                    csvfile.readline()
+                reader = LoaderUtils.csvReader(LoaderUtils.readLines(csvfile,end),params)
+            parser.parseRows(reader)
 
+        return parser.createDataset(),time.time()-t0
 
+    @staticmethod
+    def openFile(file):
+        ''' Open file for reading lines, .gz, .bz2 and .xz files are decompressed on a reader thread '''
+        if DecompressReader.isCompressed(file):
+            return DecompressReader(file)
+        return open(file, 'rb')
+
+    @staticmethod
+    def completeLinesEnd(file):
+        ''' Byte offset after the last line break of file, excludes a partly written last line '''
+        blockSize = 65536
+        with open(file, 'rb') as f:
+            f.seek(0,os.SEEK_END)
+            end = f.tell()
+            while end>0:
+                start = max(0,end-blockSize)
+                f.seek(start)
+                idx = f.read(end-start).rfind('\n')
+                if idx!=-1:
+                    return start+idx+1
+                end = start
+        return 0
 
+    @staticmethod
+    def readLines(f,end):
+        ''' Yield lines of file f starting before byte offset end '''
+        pos = f.tell()
+        while pos<end:
+            line = f.readline()
+            if not line:
+                break
+            pos += len(line)
+            yield line
+
+    @staticmethod
+    def iterCSV(params,batchSize=100000):
+        '''
+        Yield PointDataset batches parsed from up to batchSize CSV rows.
+        Only one batch of rows is held by the parser at a time.
+        '''
+        for filename in params["files"]:
+            file = params["path"]+filename
+            with LoaderUtils.openFile(file) as csvfile:
+                header = next(LoaderUtils.csvReader([csvfile.readline()],params))
+                parser = CSVRowParser(params,header,(filename,0,None))
+                reader = LoaderUtils.csvReader(csvfile,params)
+                nRows = batchSize
+                while nRows==batchSize:
+                    nRows = parser.parseRows(itertools.islice(reader,batchSize))
+                    batch = parser.createDataset()
+                    if len(batch)>0:
+                        yield batch
+
+    @staticmethod
+    def csvReader(csvfile,params):
+        return csv.reader(csvfile, delimiter=params['delimiter'], quotechar=params['quotechar'],escapechar='\\')
+
+    @staticmethod
+    def createDataset(fieldsParam,lists,epochDates=False):
+        '''
+        Create PointDataset from column lists of converted values, date columns hold raw strings
+        :param epochDates: store dates as int64 epoch seconds instead of datetime objects
+        '''
+        dataset = PointDataset()
+        for fieldData in fieldsParam:
+            id = fieldData['id']
+            type = fieldData['type']
+            if type in DATE_TYPES:
+                epoch = LoaderUtils.convertDates(lists[id],fieldData)
+                if epochDates:
+                    dataset.addColumn(id,epoch,'epoch')
+                elif type=='timestamp':
+                    dates = numpy.empty(len(epoch),dtype=object)
+                    dates[:] = [Utils.timestamp2utc(secs) for secs in epoch.tolist()]
+                    dataset.addColumn(id,dates,type)
+                else:
+                    dataset.addColumn(id,PointDataset.epochToDatetimes(epoch),type)
+            else:
+                dataset.addColumn(id,lists[id],type)
+        return dataset
+
+    @staticmethod
+    def convertDates(strs,fieldData):
+        ''' Convert a column of datetime or timestamp strings to int64 epoch seconds '''
+        if fieldData['type']=='datetime':
+            return Utils.strs2epoch(strs,fieldData['format'])
+
+        strs = numpy.array(strs,dtype=str)
+        # empty timestamps default to now
+        empty = strs==''
+        strs[empty] = '0'
+        epoch = strs.astype(numpy.float64).astype(numpy.int64)
+        epoch[empty] = Utils.utc2epoch(datetime.now())
+        return epoch
+
+    @staticmethod
+    def getCacheFilename(params):
+        ''' Cache filename keyed on file paths, mtimes, sizes, the fields spec and sample chunking '''
+        cacheDir = params.get('cache_dir',os.path.join(params['path'],'.geo_qt_cache'))
+
+        files = []
+        for filename in params['files']:
+            file = os.path.abspath(params['path']+filename)
+            stat = os.stat(file)
+            files.append([file,stat.st_mtime,stat.st_size])
+
+        key = {
+            'files':files,
+            'fields':params['fields'],
+            'delimiter':params['delimiter'],
+            'quotechar':params['quotechar'],
+            'bounds':params.get('bounds'),
+            'epoch_dates':params.get('epoch_dates',False),
+            'sample':params.get('sample')
+        }
+        if 'sample' in params:
+            # samplers are seeded per chunk, so sampled rows depend on the chunk boundaries
+            key['chunk_mb'] = params.get('chunk_mb')
+        keyStr = json.dumps(key,sort_keys=True)
+        digest = hashlib.sha1(keyStr).hexdigest()
+        return os.path.join(cacheDir,digest+'.npz')
+
+    @staticmethod
+    def saveCache(dataset,cacheFile):
+        cacheDir = os.path.dirname(cacheFile)
+        try:
+            if not os.path.exists(cacheDir):
+                os.makedirs(cacheDir)
+            dataset.save(cacheFile)
+        except (IOError,OSError) as e:
+            print('CSVLoader cache not saved:',e)
+
+    @staticmethod
+    def getConverter(fieldData):
+        ''' Function converting CSV strings to the field type, date strings are kept for column conversion '''
+        type = fieldData['type']
+        if type=='int':
+            return lambda val: 0 if val=='' or val=='NULL' else int(val)
+        elif type=='float':
+            return lambda val: 0.0 if val=='' or val=='NULL' else float(val)
+        else:
+            return lambda val: val
 
 
+def loadCSVChunk(args):
+    ''' Process pool entry point for LoaderUtils.loadChunk '''
+    return LoaderUtils.loadChunk(*args)
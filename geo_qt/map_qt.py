@@ -6,7 +6,7 @@ MapQT: map class
 
 Layer: Abstract layer class
 GeojsonLayer: Geojson layer base class. Override for custom map projections and rendering styles
-PointDataLayer: Point data base class. Override for custom datasets and rendering
+PointDataLayer: Point data base class, data is a columnar PointDataset. Override for custom datasets and rendering
 
 MapDialog: PySide dialog to interactively change map and layer properties.
 
@@ -15,15 +15,23 @@ MapDialog: PySide dialog to interactively change map and layer properties.
 import sys
 import json
 import copy
+import math
 
-import pyproj
+import numpy
 from builtins import range
 from PySide.QtCore import *
 from PySide.QtGui import *
 
+from column_store import ColumnStore
+from dataset_registry import DatasetRegistry
 from geom import Rectangle
+from geojson_loader import GeoJsonLoader
+from geometry import BoxIndex
 from loader_utils import *
 from map_utils import MapUtils
+from projection import InverseGrid, ProjectionContext
+from projection_cache import ProjectionCache
+from sqlite_source import SQLiteSource
 from utils import *
 
 
@@ -52,7 +60,7 @@ class Layer(object):
         # Proj4 source projection
         self.projSrc = None
         if 'proj' in opts:
-            self.projSrc = pyproj.Proj(opts['proj'])
+            self.projSrc = map.projection.getProj(opts['proj'])
         # Layer data
         self.data = None
 
@@ -72,6 +80,10 @@ class Layer(object):
         ''' Project geometry '''
         assert False, 'Layer is an abstract class'
 
+    def updateBounds(self):
+        ''' Map bounds changed, reproject geometry '''
+        self.project()
+
     def renderImage(self):
         ''' Render layer to QImage '''
         qp = QPainter(self.image)
@@ -97,16 +109,34 @@ class GeojsonLayer(Layer):
     def __init__(self,map,opts):
         ''' Initialise with map object and layer options '''
         super(GeojsonLayer,self).__init__(map, opts)
-        self.projGeojson = None
+        # FlatGeometry of the GeoJSON features
+        self.geometry = None
+        # projected vertex coords, nan where projection failed
+        self.projX = None
+        self.projY = None
+        # source and map projection of projX, projY
+        self.projState = None
+        # Douglas-Peucker significance of projected vertices
+        self.significance = None
+        # simplification level -> (vertex indices, ring offsets), for projState
+        self.levels = {}
+        # BoxIndex of projected feature bounding boxes
+        self.index = None
+        # (closed,QPainterPath) per drawn feature in view coords, for projState and map view state pathState
+        self.paths = None
+        self.pathState = None
         self.loadData()
         self.updateCanvasSize()
 
     def loadData(self):
-        self.geojson = MapUtils.loadGeoJson(self.opts['geojson'])
+        # streamed feature by feature, or memory-mapped from the cache with "cache":true
+        self.geometry = GeoJsonLoader.load(self.opts)
+        self.projState = None
+        self.pathState = None
 
 
     def setStyles(self,styles):
-        ''' Set styles used by renderer '''
+        ''' Set styles used by renderer, cached paths are redrawn with the new styles '''
         self.styles = styles
         self.renderImage()
 
@@ -116,64 +146,121 @@ class GeojsonLayer(Layer):
         self.renderImage()
 
     def project(self):
-        ''' Project Geojson geometry '''
-        # copy JSON and write projected points into copy
-        self.projGeojson = copy.deepcopy(self.geojson)
-        features = self.projGeojson['features']
+        ''' Project Geojson geometry, view coords are calculated when rendered '''
+        # canvas size and bounds changes do not change projected coords
+        projState = (self.projSrc.srs,self.map.proj.srs)
+        if self.projState==projState:
+            return
+        self.projState = projState
 
-        for feature in features:
-            # name = feature['properties']['NAME'] # example property
-            polys = feature['geometry']['coordinates']
+        # project all vertices in one cached transform
+        self.projX,self.projY = self.map.projection.projectArrays(self.projSrc,self.geometry.x,self.geometry.y)
 
-            for l in range(0,len(polys)):
-                if feature['geometry']['type']=="MultiPolygon":
-                    line = polys[l][0]
-                else:
-                    line = polys[l]
+        t0 = time.time()
+        self.significance = self.geometry.significance(self.projX,self.projY)
+        self.levels = {}
+        self.index = BoxIndex(self.geometry.featureBounds(self.projX,self.projY))
+        print ('GeojsonLayer significance and index:', time.time()-t0)
 
-                for i in range(0,len(line)):
-                    p = line[i]
-                    try:
-                        pt = pyproj.transform(self.projSrc,self.map.proj,p[0],p[1])
-                        line[i] = [pt[0],pt[1]]
+    def getLevel(self):
+        '''
+        Vertex indices and ring offsets simplified for the map scale, None for all vertices
+        "simplify":{"pixel_tolerance":<px>} in layer opts, default 0.5, 0 to draw all vertices.
+        Levels are tolerances of powers of 2 in projected units, so zooming within a factor of 2
+        and resizing the canvas reuse a cached level.
+        '''
+        pixelTolerance = self.opts.get('simplify',{}).get('pixel_tolerance',0.5)
+        if pixelTolerance<=0:
+            return None
+        # largest power of 2 tolerance within pixelTolerance at the current scale
+        level = int(math.floor(math.log(pixelTolerance/self.map.projToViewScale,2)))
+        if not level in self.levels:
+            self.levels[level] = self.geometry.simplifiedRings(self.significance,2.0**level)
+        return self.levels[level]
 
-                    except RuntimeError as e:
-                        line[i] = []
+    def getPaths(self):
+        '''
+        View coords QPainterPath of each feature as (closed,path), rebuilt when the projection or view changes
+        Polygon features have all parts and holes in one odd-even filled path, rings are simplified with getLevel
+        Only features with a bounding box on the canvas are built. With "clip":true in layer opts, polygons
+        larger than the canvas are clipped to it.
+        '''
+        pathState = (self.projState,self.map.getViewState())
+        if self.pathState==pathState:
+            return self.paths
+        self.pathState = pathState
 
+        t0 = time.time()
+        geometry = self.geometry
+        level = self.getLevel()
+        if level==None:
+            vx,vy = self.map.pointToView(self.projX,self.projY)
+            ringOffsets = geometry.ringOffsets.tolist()
+        else:
+            vertices,ringOffsets = level
+            vx,vy = self.map.pointToView(self.projX[vertices],self.projY[vertices])
+            ringOffsets = ringOffsets.tolist()
+        vx = vx.tolist()
+        vy = vy.tolist()
+        # rings with a vertex that failed projection are not drawn
+        ringValid = geometry.ringValid(self.projX).tolist()
+        partOffsets = geometry.partOffsets.tolist()
+        featureOffsets = geometry.featureOffsets.tolist()
+        closed = geometry.closed.tolist()
+
+        # canvas and a margin for the pen, so clipped edges are not drawn
+        margin = 10
+        clip = QPainterPath()
+        clip.addRect(QRectF(-margin,-margin,self.map.canvasW+2*margin,self.map.canvasH+2*margin))
+        # view size of feature bounding boxes
+        scale = self.map.projToViewScale
+        features = self.index.query(self.map.getViewProjBounds())
+        large = ((self.index.bounds[features,2]-self.index.bounds[features,0])*scale>self.map.canvasW) | \
+                ((self.index.bounds[features,3]-self.index.bounds[features,1])*scale>self.map.canvasH)
+        clipped = set(features[large].tolist()) if self.opts.get('clip',False) else set()
+
+        self.paths = []
+        for f in features.tolist():
+            path = QPainterPath()
+            path.setFillRule(Qt.OddEvenFill)
+            # closed rings need 3 distinct vertices, simplifiedRings keeps them for rings that have them
+            minVertices = 4 if closed[f] else 2
+            for p in range(featureOffsets[f],featureOffsets[f+1]):
+                outer = partOffsets[p]
+                if closed[f] and not (ringValid[outer] and ringOffsets[outer+1]-ringOffsets[outer]>=minVertices):
+                    # outer ring failed projection or has too few vertices in the source
+                    continue
+                for r in range(partOffsets[p],partOffsets[p+1]):
+                    start = ringOffsets[r]
+                    end = ringOffsets[r+1]
+                    if not ringValid[r] or end-start<minVertices:
+                        continue
+                    path.addPolygon(QPolygonF([QPointF(x,y) for x,y in zip(vx[start:end],vy[start:end])]))
+                    if closed[f]:
+                        path.closeSubpath()
+            if closed[f] and f in clipped:
+                path = path.intersected(clip)
+            if not path.isEmpty():
+                self.paths.append((closed[f],path))
+
+        print ('GeojsonLayer paths:', len(self.paths), 'of', geometry.featureCount(), time.time()-t0)
+        return self.paths
 
     def render(self,qp):
-        ''' Render projected geometry using option styles '''
+        ''' Render cached feature paths using option styles '''
         qp.setBrush(Qt.cyan)
         qp.setPen(Qt.black)
         # Set QPainter styles
         MapUtils.setStylesFromJson(qp, self.styles)
 
         t0 = time.time()
-        features = self.projGeojson['features']
-
-        for feature in features:
-            # name = feature['properties']['NAME'] # example property
-            polys = feature['geometry']['coordinates']
-
-            for l in range(0,len(polys)):
-                if feature['geometry']['type']=="MultiPolygon":
-                    line = polys[l][0]
-                else:
-                    line = polys[l]
-
-                ptList = []
-                validLine = True
-                for i in range(0,len(line)):
-                    p = line[i]
-                    if len(p)==2:
-                        pt = self.map.pointToView(p[0],p[1])
-                        ptList.append(QPointF(pt[0],pt[1]))
-                    else:
-                        validLine = False
-
-                if validLine:
-                    qPoly = QPolygonF(ptList)
-                    qp.drawPolygon(qPoly)
+        pen = qp.pen()
+        for closed,path in self.getPaths():
+            if closed:
+                qp.drawPath(path)
+            else:
+                # lines are not filled
+                qp.strokePath(path,pen)
 
         t1 = time.time()
         print ('drawGeoJson:', t1-t0)
@@ -184,13 +271,140 @@ class PointDataLayer(Layer):
 
     def __init__(self,map,opts):
         super(PointDataLayer,self).__init__(map, opts)
+        # QTimer polling "follow" files, reused when the data is reloaded
+        self.followTimer = None
         self.loadData()
-        self.updateCanvasSize()
+        # streamed data is already projected and drawn for the current view
+        if self.image==None or self.data.viewState!=self.map.getViewState():
+            self.updateCanvasSize()
 
     def loadData(self):
+        self.data = self.loadDataset()
+
+    def isSampled(self):
+        return 'sample' in self.opts
+
+    def setSampled(self,sampled):
+        ''' Switch between the "sample" opts rows and the full data, reload and render '''
+        if sampled==self.isSampled():
+            return
+        if sampled:
+            self.opts['sample'] = self.sampleOpts
+        else:
+            self.sampleOpts = self.opts.pop('sample')
+        self.loadData()
+        self.project()
+        self.renderImage()
+
+    def loadDataset(self):
+        ''' Load dataset for opts datatype '''
         datatype = self.opts['datatype']
         if datatype == "csv":
-            self.data = LoaderUtils.loadCSV(self.opts)
+            if 'follow' in self.opts:
+                return self.loadFollow()
+            if 'stream' in self.opts:
+                return self.loadStream()
+            return self.map.datasets.getDataset(self.opts,LoaderUtils.loadCSV)
+        elif datatype == "columns":
+            return self.map.datasets.getDataset(self.opts,ColumnStore.load)
+        elif datatype == "sqlite":
+            # rows depend on the map bounds, so sqlite datasets are not shared
+            return SQLiteSource.load(self.opts,self.map.lngLatBounds.toList())
+
+    def loadStream(self):
+        '''
+        Load CSV in batches, "stream":{"batch_size":<rows>}
+        Each batch is projected and drawn onto the layer image as it arrives
+        '''
+        batchSize = self.opts['stream'].get('batch_size',100000)
+        t0 = time.time()
+
+        # Layer must be on the map to be painted between batches, MapQt keeps config layer order
+        self.map.addLayer(self)
+        self.setImageSize(self.map.canvasW,self.map.canvasH)
+
+        batches = []
+        nRows = 0
+        for batch in LoaderUtils.iterCSV(self.opts,batchSize):
+            self.projectData(batch)
+            self.renderBatch(batch)
+            batches.append(batch)
+            nRows += len(batch)
+
+            if self.map.renderCallback:
+                self.map.renderCallback("Load data: "+str(nRows)+" rows, "+"{:.2f}".format(time.time()-t0)+"s")
+            self.map.repaint()
+            QCoreApplication.instance().processEvents()
+
+        print ('Stream data:', nRows, time.time()-t0)
+        # keeps the projected columns and projState, viewState of the batches
+        return PointDataset.concat(batches)
+
+    def loadFollow(self):
+        '''
+        Load CSV files and poll them for appended rows, "follow":{"interval_ms":<ms>}
+        Only complete lines are read, later polls parse only the new bytes.
+        Compressed files cannot be followed, their offsets are not file offsets.
+        '''
+        for filename in self.opts['files']:
+            if DecompressReader.isCompressed(filename):
+                raise ValueError('Compressed file cannot be followed: '+filename)
+
+        self.followOffsets = {}
+        datasets = []
+        for filename in self.opts['files']:
+            end = LoaderUtils.completeLinesEnd(self.opts['path']+filename)
+            self.followOffsets[filename] = end
+            datasets.append(LoaderUtils.loadChunk(self.opts,(filename,0,end))[0])
+
+        if self.followTimer==None:
+            self.followTimer = QTimer(self.map)
+            self.followTimer.timeout.connect(self.followFiles)
+        self.followTimer.start(self.opts['follow'].get('interval_ms',2000))
+
+        return PointDataset.concat(datasets)
+
+    def followFiles(self):
+        ''' Parse rows appended to followed files since the last poll '''
+        batches = []
+        for filename in self.opts['files']:
+            start = self.followOffsets[filename]
+            end = LoaderUtils.completeLinesEnd(self.opts['path']+filename)
+            if end<start:
+                print('Follow file truncated:',filename)
+                self.followOffsets[filename] = end
+            elif end>start:
+                batch = LoaderUtils.loadChunk(self.opts,(filename,start,end))[0]
+                self.followOffsets[filename] = end
+                if len(batch)>0:
+                    batches.append(batch)
+
+        if len(batches)>0:
+            self.appendData(PointDataset.concat(batches))
+            self.map.update()
+
+    def appendData(self,batch):
+        ''' Project, style and draw new rows onto the layer image without a full render '''
+        self.projectData(batch)
+        self.renderBatch(batch)
+
+        self.data = PointDataset.concat([self.data,batch])
+        print('Append data:',len(batch),len(self.data))
+
+    def prepareBatch(self):
+        ''' Prepare streamed batch in self.data for rendering. Override to add styles '''
+        pass
+
+    def renderBatch(self,batch):
+        ''' Render batch onto layer image without clearing it '''
+        data = self.data
+        self.data = batch
+        self.prepareBatch()
+        qp = QPainter(self.image)
+        qp.setRenderHint(QPainter.Antialiasing)
+        self.render(qp)
+        qp.end()
+        self.data = data
 
     def setStyles(self,styles):
         self.styles = styles
@@ -201,32 +415,45 @@ class PointDataLayer(Layer):
         self.project()
         self.renderImage()
 
+    def updateBounds(self):
+        ''' Override re-queries sqlite data for the new map bounds '''
+        if self.opts['datatype']=='sqlite':
+            self.loadData()
+        self.project()
+
     def project(self):
         ''' Project points and transform to map view coords '''
-        items = self.data
-        nItems = len(items)
+        self.projectData(self.data)
+
+    def projectData(self,data):
+        ''' Project PointDataset data, adds projLng, projLat, vx, vy and valid columns '''
+        # views share the projected columns of their base dataset
+        if data.base!=None:
+            data = data.base
+
+        # skip steps another layer or an earlier call has done for the current projection and view
+        projState = (self.projSrc.srs,self.map.proj.srs)
+        viewState = self.map.getViewState()
+        if data.projState==projState and data.viewState==viewState:
+            return
 
         t1 = time.time()
 
-        for i in range(0,nItems):
-            item = items[i]
+        if data.projState!=projState:
+            # one transform call for all rows, failed rows are nan
+            projLng,projLat = self.map.projection.projectArrays(self.projSrc,data.column('lng'),data.column('lat'))
 
-            item.projLng = None
-            item.projLat = None
-            item.vx = None
-            item.vy = None
-
-            # if(self.map.lngLatBounds.within(item.lng,item.lat)):
-            try:
-                pt = pyproj.transform(self.projSrc,self.map.proj,item.lng,item.lat)
-                item.projLng = pt[0]
-                item.projLat = pt[1]
-                viewPt = self.map.pointToView(item.projLng, item.projLat)
-                item.vx = viewPt[0]
-                item.vy = viewPt[1]
+            # mask out rows that failed projection
+            data.addColumn('projLng',projLng)
+            data.addColumn('projLat',projLat)
+            data.addColumn('valid',~numpy.isnan(projLng))
+            data.projState = projState
 
-            except RuntimeError as e:
-                pass
+        # canvas size and bounds changes only need the projected to view transform
+        vx,vy = self.map.pointToView(data.column('projLng'),data.column('projLat'))
+        data.addColumn('vx',vx)
+        data.addColumn('vy',vy)
+        data.viewState = viewState
 
         t2 = time.time()
         print ('updateDataCoords:', t2-t1)
@@ -245,8 +472,8 @@ class PointDataLayer(Layer):
         ''' Render projected geometry using option styles. Override for custom styles and rendering. '''
 
         t0 = time.time()
-        items = self.data
-        nItems = len(items)
+        data = self.data
+        nItems = len(data)
 
         qp.setCompositionMode(QPainter.CompositionMode_SourceOver)
 
@@ -263,17 +490,18 @@ class PointDataLayer(Layer):
         qp.setPen(Qt.NoPen)
         qp.setBrush(ptCol)
 
-        for i in range(0,nItems):
-            item = items[i]
+        vx = data.column('vx')
+        vy = data.column('vy')
+        for i in data.validIndices():
             if i%1000 == 0 or i == nItems-1:
                 self.progress("Render data:",t0,i,nItems-1)
 
-            # if self.map.lngLatBounds.within(item.lng,item.lat):
-            if item.vx and item.vy:
-                if ptSize>2:
-                    qp.drawEllipse(item.vx, item.vy, ptSize, ptSize)
-                else:
-                    qp.drawRect(QRectF(int(item.vx-ptSize/2), int(item.vy-ptSize/2), ptSize, ptSize))
+            x = vx.item(i)
+            y = vy.item(i)
+            if ptSize>2:
+                qp.drawEllipse(x, y, ptSize, ptSize)
+            else:
+                qp.drawRect(QRectF(int(x-ptSize/2), int(y-ptSize/2), ptSize, ptSize))
 
         t1 = time.time()
         print 'Render Data:', t1-t0
@@ -311,9 +539,24 @@ class MapQt(QMainWindow):
         ''' Initialise with dict containing mapOpts field '''
         self.mapOpts = None
         self.layers = []
-
-        self.epsg4326 = pyproj.Proj(init='epsg:4326')
-        self.epsg3857 = pyproj.Proj(init='epsg:3857')
+        # config layer opts, layers added from them are drawn in this order
+        self.layersOpts = config.get('layers',[])
+        # Datasets shared by layers with the same source
+        self.datasets = DatasetRegistry()
+        self.datasets.registerLayers(config.get('layers',[]))
+        # Projected coordinates of layer data, up to "projection_cache_mb" in memory,
+        # "projection_cache_dir" in mapOpts also saves them to disk
+        # point and vertex arrays above "parallel_projection" {"threshold":<points>,"workers":<processes>} use a process pool
+        mapOpts = config.get('mapOpts',{})
+        parallelOpts = mapOpts.get('parallel_projection',{})
+        projectionCache = ProjectionCache(mapOpts.get('projection_cache_dir'),int(mapOpts.get('projection_cache_mb',256)*1024*1024),
+                                          parallelOpts.get('threshold',2000000),parallelOpts.get('workers'))
+        # Cached Proj objects, projected bounds and transforms used by layers and dialogs
+        # "fast_projections":["merc","laea"] enables closed-form transforms for LAEA as well as Web Mercator
+        self.projection = ProjectionContext(projectionCache,mapOpts.get('fast_projections'))
+
+        self.epsg4326 = self.projection.epsg4326
+        self.epsg3857 = self.projection.epsg3857
 
         # map container
         self.imageLabel = None
@@ -337,6 +580,19 @@ class MapQt(QMainWindow):
         self.renderCallback = None
         # Dialog mouse lng lat callback
         self.mousePosCallback = None
+        # Last mouse view position, approximate lng lat from the inverse grid is shown at most
+        # "mouse_pos_fps" times a second, the exact lng lat when the mouse stops
+        self.mousePos = None
+        self.inverseGrid = None
+        self.inverseGridState = None
+        self.mousePosTimer = QTimer(self)
+        self.mousePosTimer.setSingleShot(True)
+        self.mousePosTimer.setInterval(int(1000/mapOpts.get('mouse_pos_fps',60)))
+        self.mousePosTimer.timeout.connect(self.updateMousePos)
+        self.mouseStopTimer = QTimer(self)
+        self.mouseStopTimer.setSingleShot(True)
+        self.mouseStopTimer.setInterval(150)
+        self.mouseStopTimer.timeout.connect(self.refineMousePos)
         # Render overlay
         self.isOverlay = False
 
@@ -354,7 +610,7 @@ class MapQt(QMainWindow):
 
         self.canvasW = self.mapOpts['canvasSize'][0]
         self.canvasH = self.mapOpts['canvasSize'][1]
-        self.proj = pyproj.Proj(self.mapOpts['proj'])
+        self.proj = self.projection.setProj(self.mapOpts['proj'])
 
         bounds = Rectangle()
         bounds.fromList(self.mapOpts['bounds'])
@@ -362,8 +618,25 @@ class MapQt(QMainWindow):
         self.setViewBounds()
 
     def addLayer(self, layer):
+        ''' Add layer, layers of the config "layers" list are kept in config order '''
+        if layer in self.layers:
+            return
+        order = self.getLayerOrder(layer)
+        if order!=None:
+            for i,other in enumerate(self.layers):
+                otherOrder = self.getLayerOrder(other)
+                if otherOrder!=None and otherOrder>order:
+                    self.layers.insert(i,layer)
+                    return
         self.layers.append(layer)
 
+    def getLayerOrder(self,layer):
+        ''' Index of layer opts in the config "layers" list, None for other layers '''
+        for i,opts in enumerate(self.layersOpts):
+            if opts is layer.opts:
+                return i
+        return None
+
     def getLayersByType(self,layerType):
         return filter(lambda layer: layer.type == layerType, self.layers)
 
@@ -412,7 +685,7 @@ class MapQt(QMainWindow):
     def setMapBounds(self,bounds):
         ''' Set map lng lat bounds '''
         self.lngLatBounds = bounds
-        pb = MapUtils.projectedBounds(self.epsg4326,self.proj,bounds.toList())
+        pb = self.projection.projectedBounds(bounds.toList())
         self.projBounds.fromList(pb)
 
     def setViewBounds(self):
@@ -453,13 +726,13 @@ class MapQt(QMainWindow):
         self.setViewBounds()
 
         for layer in self.layers:
-            layer.project()
+            layer.updateBounds()
             layer.clearImage()
             layer.renderImage()
 
     def updateProjection(self,proj4Str):
         ''' Update map Proj4 projection, reproject and render '''
-        self.proj=pyproj.Proj(proj4Str)
+        self.proj = self.projection.setProj(proj4Str)
         self.updateBounds(self.lngLatBounds)
 
 
@@ -492,11 +765,18 @@ class MapQt(QMainWindow):
 
     def projPoint(self,lng,lat,projSrc='+init=epsg:4326'):
         ''' Project point from projSrc to map projection '''
-        try:
-            pt = pyproj.transform(projSrc,self.proj,lng,lat)
-            return [pt[0],pt[1]]
-        except RuntimeError as e:
-            return None
+        return self.projection.forwardPoint(lng,lat,projSrc)
+
+    def getViewState(self):
+        ''' Projected bounds, scale and canvas size used by pointToView '''
+        return (tuple(self.projBounds.toList()),self.projToViewScale,self.canvasW,self.canvasH)
+
+    def getViewProjBounds(self):
+        ''' Projected bounds l,b,r,t of the whole canvas, which contains projBounds '''
+        pc = self.projBounds.getCentre()
+        w = self.canvasW/2.0/self.projToViewScale
+        h = self.canvasH/2.0/self.projToViewScale
+        return [pc[0]-w,pc[1]-h,pc[0]+w,pc[1]+h]
 
     def pointToView(self,px,py):
         ''' Projected point to view coords '''
@@ -510,12 +790,7 @@ class MapQt(QMainWindow):
         pc = self.projBounds.getCentre()
         px = pc[0] + (x-self.canvasW/2)/self.projToViewScale
         py = pc[1] - (y-self.canvasH/2)/self.projToViewScale
-        try:
-            pt = pyproj.transform(self.proj,self.epsg4326,px,py)
-            return[pt[0],pt[1]]
-
-        except RuntimeError as e:
-            return None
+        return self.projection.inversePoint(px,py)
 
     def getCaptureName(self):
         ''' Get image capture filename and format. Override for custom image capture. '''
@@ -564,12 +839,38 @@ class MapQt(QMainWindow):
     def onMouseMove(self, x, y):
         ''' Called by MapWidget to display mouse lnglat '''
         if self.mousePosCallback:
+            self.mousePos = (x,y)
+            if not self.mousePosTimer.isActive():
+                self.mousePosTimer.start()
+            self.mouseStopTimer.start()
+
+    def getInverseGrid(self):
+        ''' Inverse lookup grid for the current projection and view '''
+        state = (self.proj.srs,)+self.getViewState()
+        if self.inverseGridState!=state:
+            self.inverseGrid = InverseGrid(self)
+            self.inverseGridState = state
+        return self.inverseGrid
+
+    def updateMousePos(self):
+        ''' Display approximate mouse lnglat '''
+        x,y = self.mousePos
+        p = self.getInverseGrid().lookup(x,y)
+        if p==None:
             p = self.viewToLngLat(x,y)
-            if p==None:
-                txt = ""
-            else:
-                txt = "{:.5f}, {:.5f}".format(p[0],p[1])
-            self.mousePosCallback(txt)
+        self.setMousePos(p)
+
+    def refineMousePos(self):
+        ''' Display exact lnglat when the mouse stops '''
+        self.mousePosTimer.stop()
+        self.setMousePos(self.viewToLngLat(*self.mousePos))
+
+    def setMousePos(self,p):
+        if p==None:
+            txt = ""
+        else:
+            txt = "{:.5f}, {:.5f}".format(p[0],p[1])
+        self.mousePosCallback(txt)
 
     def setOverlay(self, txt, x, y):
         self.overlay = txt
@@ -726,6 +1027,13 @@ class MapDialog(QDialog):
             self.uiList.append(dataEdit)
             self.uiList.append(dataUpdateButton)
 
+            if 'sample' in layer.opts:
+                sampleCheck = QCheckBox('Sampled data', self)
+                sampleCheck.setChecked(True)
+                self.form_layout.addRow('',sampleCheck)
+                sampleCheck.toggled.connect(lambda checked: self.on_sample_toggled(checked,layer))
+                self.uiList.append(sampleCheck)
+
     def addStatus(self):
         ''' Display function progress '''
         self.statusBox = QHBoxLayout()
@@ -782,7 +1090,7 @@ class MapDialog(QDialog):
         val = str(self.proj_edit.text())
         if val:
             try:
-                proj=pyproj.Proj(val)
+                self.view.projection.getProj(val)
                 self.view.updateProjection(val)
                 self.updateViewBounds()
                 self.view.repaint()
@@ -822,6 +1130,11 @@ class MapDialog(QDialog):
         self.view.repaint()
 
 
+    def on_sample_toggled(self,checked,layer):
+        ''' Switch layer between sampled and full data '''
+        layer.setSampled(checked)
+        self.view.repaint()
+
     @Slot()
     def on_capture_click(self):
         self.view.captureView()
@@ -2,14 +2,29 @@
 MapQt utility functions
 '''
 
+import atexit
+import ctypes
 import json
+import multiprocessing
+import numpy
 import pyproj
+from multiprocessing.sharedctypes import RawArray
 
 from PySide.QtGui import *
 
+from fast_projection import FastTransform
+
 
 class MapUtils(object):
 
+    # transform functions by (source srs, destination srs, fastTransforms)
+    transformers = {}
+    # transformArraysParallel (pool, workers, shared x, shared y), None until first used
+    transformPool = None
+    # default projections using closed-form NumPy transforms for lng lat to and from them, "merc" and "laea"
+    # maps pass their own with the fastTransforms argument
+    fastTransforms = ('merc',)
+
     @staticmethod
     def loadGeoJson(filename):
         '''  Load JSON from filename '''
@@ -99,6 +114,115 @@ class MapUtils(object):
 
         return bounds
 
+    @staticmethod
+    def getTransformer(projSrc,projDest,fastTransforms=None):
+        '''
+        Cached function projecting x,y arrays from projSrc to projDest Proj
+        Pairs supported by FastTransform for the projections in fastTransforms use it, otherwise
+        pyproj>=2 Transformer objects are reused and older versions call pyproj.transform
+        :param fastTransforms: enabled FastTransform projections, default MapUtils.fastTransforms
+        '''
+        if fastTransforms==None:
+            fastTransforms = MapUtils.fastTransforms
+        key = (projSrc.srs,projDest.srs,fastTransforms)
+        transformer = MapUtils.transformers.get(key)
+        if transformer==None:
+            if fastTransforms:
+                transformer = FastTransform.get(projSrc,projDest,fastTransforms)
+            if transformer==None and hasattr(pyproj,'Transformer'):
+                transformer = pyproj.Transformer.from_proj(projSrc,projDest,always_xy=True).transform
+            elif transformer==None:
+                transformer = lambda x,y: pyproj.transform(projSrc,projDest,x,y)
+            MapUtils.transformers[key] = transformer
+        return transformer
+
+    @staticmethod
+    def transformArrays(projSrc,projDest,x,y,fastTransforms=None):
+        '''
+        Project coordinate arrays in one call
+        :param fastTransforms: enabled FastTransform projections, default MapUtils.fastTransforms
+        :return: float64 arrays px,py, nan where the projection failed or is infinite
+        '''
+        x = numpy.array(x,dtype=numpy.float64)
+        y = numpy.array(y,dtype=numpy.float64)
+        if len(x)==0:
+            return x,y
+        transform = MapUtils.getTransformer(projSrc,projDest,fastTransforms)
+        try:
+            px,py = transform(x,y)
+        except RuntimeError:
+            # some pyproj versions raise for the whole array, project points one at a time
+            px = numpy.empty(len(x))
+            py = numpy.empty(len(x))
+            for i in range(0,len(x)):
+                try:
+                    px[i],py[i] = transform(x[i],y[i])
+                except RuntimeError:
+                    px[i] = py[i] = numpy.nan
+        px = numpy.asarray(px,dtype=numpy.float64)
+        py = numpy.asarray(py,dtype=numpy.float64)
+        invalid = ~(numpy.isfinite(px) & numpy.isfinite(py))
+        px[invalid] = numpy.nan
+        py[invalid] = numpy.nan
+        return px,py
+
+    @staticmethod
+    def transformArraysParallel(projSrc,projDest,x,y,workers=None,chunkSize=None,fastTransforms=None):
+        '''
+        Project coordinate arrays in a process pool
+        Coordinates are copied into the shared memory of the pool, workers project chunks in place,
+        so no arrays are pickled between processes
+        :return: float64 arrays px,py, nan where the projection failed
+        '''
+        n = len(x)
+        if workers==None:
+            workers = multiprocessing.cpu_count()
+        if fastTransforms==None:
+            fastTransforms = MapUtils.fastTransforms
+        if chunkSize==None:
+            # a few chunks per worker to balance uneven transform costs
+            chunkSize = max(1,-(-n//(workers*4)))
+
+        pool,sharedX,sharedY = MapUtils.getTransformPool(workers,n)
+        px = numpy.frombuffer(sharedX,dtype=numpy.float64,count=n)
+        py = numpy.frombuffer(sharedY,dtype=numpy.float64,count=n)
+        px[:] = x
+        py[:] = y
+
+        tasks = [(start,min(start+chunkSize,n),projSrc.srs,projDest.srs,fastTransforms)
+                 for start in range(0,n,chunkSize)]
+        pool.map(transformChunk,tasks)
+        # shared arrays are reused by the next call
+        return px.copy(),py.copy()
+
+    @staticmethod
+    def getTransformPool(workers,n):
+        '''
+        Process pool and shared x,y arrays of at least n points, created once and reused
+        The pool is only recreated for another number of workers or more points
+        '''
+        if MapUtils.transformPool!=None:
+            pool,poolWorkers,sharedX,sharedY = MapUtils.transformPool
+            if poolWorkers==workers and len(sharedX)>=n:
+                return pool,sharedX,sharedY
+            MapUtils.closeTransformPool()
+
+        sharedX = RawArray(ctypes.c_double,n)
+        sharedY = RawArray(ctypes.c_double,n)
+        # shared arrays are passed to workers when the pool starts
+        pool = multiprocessing.Pool(workers,initializer=initTransformWorker,initargs=(sharedX,sharedY))
+        MapUtils.transformPool = (pool,workers,sharedX,sharedY)
+        return pool,sharedX,sharedY
+
+    @staticmethod
+    def closeTransformPool():
+        ''' Stop the transformArraysParallel process pool, called on exit '''
+        if MapUtils.transformPool!=None:
+            pool = MapUtils.transformPool[0]
+            MapUtils.transformPool = None
+            pool.close()
+            pool.join()
+
     @staticmethod
     def getBoundsByAspect(bbList,aspect,projSrc,projDest):
         ''' Return bounds adjusted for aspect ratio '''
@@ -129,3 +253,29 @@ class MapUtils(object):
 
         return [nbl[0],nbl[1],ntr[0],ntr[1]]
 
+
+# Process pool worker state for MapUtils.transformArraysParallel
+transformWorker = {}
+
+def initTransformWorker(sharedX,sharedY):
+    transformWorker['x'] = numpy.frombuffer(sharedX,dtype=numpy.float64)
+    transformWorker['y'] = numpy.frombuffer(sharedY,dtype=numpy.float64)
+    # srs -> Proj
+    transformWorker['projs'] = {}
+
+def getWorkerProj(srs):
+    projs = transformWorker['projs']
+    if not srs in projs:
+        projs[srs] = pyproj.Proj(srs)
+    return projs[srs]
+
+def transformChunk(task):
+    ''' Project shared coordinates in range (start,end) of task in place '''
+    start,end,srcSrs,destSrs,fastTransforms = task
+    x = transformWorker['x'][start:end]
+    y = transformWorker['y'][start:end]
+    px,py = MapUtils.transformArrays(getWorkerProj(srcSrs),getWorkerProj(destSrs),x,y,fastTransforms)
+    x[:] = px
+    y[:] = py
+
+atexit.register(MapUtils.closeTransformPool)
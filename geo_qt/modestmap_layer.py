@@ -4,7 +4,6 @@ https://github.com/stamen/modestmaps-py
 '''
 
 import sys
-import pyproj
 import PySide
 from PySide.QtCore import *
 from PySide.QtGui import *
@@ -57,12 +56,11 @@ class ModestMapLayer(Layer):
         mm = MM.mapByExtentZoom(provider, sw, ne, z)
         self.mm = mm
 
-        epsg3857 = pyproj.Proj(init='epsg:3857')
-        epsg4326 = pyproj.Proj(init='epsg:4326')
+        projection = self.map.projection
 
         # Resize map to dimensions of tiles
-        psw = pyproj.transform(epsg4326,epsg3857,bnds.l,bnds.b)
-        pne = pyproj.transform(epsg4326,epsg3857,bnds.r,bnds.t)
+        psw = projection.transformPoint(projection.epsg4326,projection.epsg3857,bnds.l,bnds.b)
+        pne = projection.transformPoint(projection.epsg4326,projection.epsg3857,bnds.r,bnds.t)
         self.map.projBounds.set(psw[0],psw[1],pne[0],pne[1])
 
         self.map.canvasW = self.viewW = mm.dimensions.x
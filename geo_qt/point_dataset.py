@@ -0,0 +1,383 @@
+'''
+Columnar point dataset
+
+PointDataset: one typed numpy array per field, lng/lat/vx/vy as float arrays
+DataRow: row accessor giving attribute access to the columns of a dataset row
+ViewColumns: column dict of a dataset view, falls back to the columns of the base dataset
+StringColumn: string column stored as one concatenated UTF-8 buffer and an offsets array
+
+'''
+
+import json
+import os
+
+import numpy
+from builtins import range
+
+from utils import Utils
+
+# numpy dtype used for each loader field type, other types are stored as objects
+FIELD_DTYPES = {
+    'int':numpy.int64,
+    'float':numpy.float64,
+    'string':object,
+    'datetime':object,
+    'timestamp':object,
+    'epoch':numpy.int64
+}
+
+# Columns always stored as float arrays
+FLOAT_COLUMNS = ('lng','lat','projLng','projLat','vx','vy')
+
+
+class DataRow(object):
+    '''
+    Row accessor for code reading rows as objects.
+    Reading item.title returns dataset.columns['title'][index],
+    setting item.fs = {} stores the value in a dataset column.
+    Rows of one iteration share the columns resolved by PointDataset.resolveColumns.
+    '''
+    __slots__ = ('_dataset','_index','_columns')
+
+    def __init__(self,dataset,index,columns=None):
+        object.__setattr__(self,'_dataset',dataset)
+        object.__setattr__(self,'_index',index)
+        object.__setattr__(self,'_columns',columns if columns!=None else dataset.resolveColumns())
+
+    def __getattr__(self,name):
+        columns = self._columns
+        if not name in columns:
+            # column added after the columns were resolved
+            columns.update(self._dataset.resolveColumns())
+        if name in columns:
+            return columns[name].item(self._index)
+        raise AttributeError(name)
+
+    def __setattr__(self,name,value):
+        self._dataset.setValue(name,self._index,value)
+        self._columns[name] = self._dataset.columns[name]
+
+    @property
+    def index(self):
+        return self._index
+
+
+class StringColumn(object):
+    '''
+    Strings stored as one concatenated UTF-8 byte buffer with an offsets array,
+    string i is buffer[offsets[i]:offsets[i+1]]. Strings are only created when read.
+    '''
+    def __init__(self,buffer,offsets):
+        # uint8 array, may be a numpy.memmap
+        self.buffer = buffer
+        # int64 array of length n+1
+        self.offsets = offsets
+
+    @staticmethod
+    def fromList(strs):
+        strs = [s.encode('utf8') if isinstance(s,unicode) else s for s in strs]
+        n = len(strs)
+        offsets = numpy.zeros(n+1,dtype=numpy.int64)
+        if n>0:
+            numpy.cumsum(numpy.fromiter((len(s) for s in strs),dtype=numpy.int64,count=n),out=offsets[1:])
+        if offsets[-1]>0:
+            buffer = numpy.frombuffer(''.join(strs),dtype=numpy.uint8)
+        else:
+            buffer = numpy.zeros(0,dtype=numpy.uint8)
+        return StringColumn(buffer,offsets)
+
+    @staticmethod
+    def concat(columns):
+        buffer = numpy.concatenate([c.buffer for c in columns])
+        offsets = [numpy.zeros(1,dtype=numpy.int64)]
+        start = 0
+        for c in columns:
+            offsets.append(c.offsets[1:]-c.offsets[0]+start)
+            start += c.offsets[-1]-c.offsets[0]
+        return StringColumn(buffer,numpy.concatenate(offsets))
+
+    def item(self,index):
+        if index<0:
+            index += len(self)
+        return self.buffer[self.offsets.item(index):self.offsets.item(index+1)].tostring()
+
+    def take(self,indices):
+        ''' New column of the strings at indices '''
+        starts = self.offsets[indices]
+        lengths = self.offsets[indices+1]-starts
+        offsets = numpy.zeros(len(indices)+1,dtype=numpy.int64)
+        numpy.cumsum(lengths,out=offsets[1:])
+        # index of each byte of the selected strings in the source buffer
+        byteIndices = numpy.arange(offsets[-1],dtype=numpy.int64)+numpy.repeat(starts-offsets[:-1],lengths)
+        return StringColumn(self.buffer[byteIndices],offsets)
+
+    def tolist(self):
+        return [self.item(i) for i in range(0,len(self))]
+
+    def __getitem__(self,key):
+        if isinstance(key,(int,long,numpy.integer)):
+            return self.item(key)
+        # slice, boolean mask or index array
+        indices = numpy.arange(len(self))[key]
+        return self.take(indices)
+
+    def __len__(self):
+        return len(self.offsets)-1
+
+    def __iter__(self):
+        for i in range(0,len(self)):
+            yield self.item(i)
+
+
+class ViewColumns(dict):
+    '''
+    Column dict holding view columns, missing ids are read from the base dataset columns
+    Per-row code should read arrays from PointDataset.resolveColumns, not look up ids per row
+    '''
+    def __init__(self,base):
+        super(ViewColumns,self).__init__()
+        self.base = base
+
+    def __missing__(self,id):
+        return self.base[id]
+
+    def __contains__(self,id):
+        return dict.__contains__(self,id) or id in self.base
+
+    def get(self,id,default=None):
+        return self[id] if id in self else default
+
+    def keys(self):
+        return list(set(dict.keys(self)) | set(self.base.keys()))
+
+    def __iter__(self):
+        return iter(self.keys())
+
+
+class PointDataset(object):
+    ''' Columnar point dataset '''
+
+    def __init__(self,columns=None,types=None):
+        # column id -> numpy array
+        self.columns = {}
+        # column id -> loader field type
+        self.types = {}
+        self.size = 0
+        # loader per-file timing, [{"file","secs","rows","chunks"}]
+        self.timings = []
+        # dataset shared by views
+        self.base = None
+        # source and map projection of the projLng, projLat and valid columns
+        self.projState = None
+        # map view of the vx, vy columns
+        self.viewState = None
+        if columns:
+            for id in columns:
+                type = types[id] if types and id in types else None
+                self.addColumn(id,columns[id],type)
+
+    @staticmethod
+    def fromLists(fieldsParam,lists):
+        '''
+        Create dataset from a dict of column lists
+        :param fieldsParam: loader fields list, [{"id":<id>,"type":<type>,...}]
+        :param lists: dict of column id -> list of values
+        '''
+        dataset = PointDataset()
+        for fieldData in fieldsParam:
+            id = fieldData['id']
+            dataset.addColumn(id,lists[id],fieldData['type'])
+        return dataset
+
+    @staticmethod
+    def concat(datasets):
+        '''
+        Concatenate datasets in list order
+        Columns missing from any dataset, such as derived columns added by one layer, are dropped.
+        projState and viewState are kept when all datasets were projected for the same state.
+        '''
+        dataset = PointDataset()
+        if len(datasets)==0:
+            return dataset
+        first = datasets[0]
+        for id in first.columns:
+            if not all(id in d.columns for d in datasets[1:]):
+                continue
+            columns = [d.columns[id] for d in datasets]
+            if isinstance(columns[0],StringColumn):
+                array = StringColumn.concat(columns)
+            else:
+                array = numpy.concatenate(columns)
+            dataset.addColumn(id,array,first.types[id])
+
+        # views share the projection state of their base dataset
+        bases = [d.base if d.base!=None else d for d in datasets]
+        if all(base.projState==bases[0].projState for base in bases):
+            dataset.projState = bases[0].projState
+            if all(base.viewState==bases[0].viewState for base in bases):
+                dataset.viewState = bases[0].viewState
+        return dataset
+
+    @staticmethod
+    def columnDtype(id,type):
+        if id in FLOAT_COLUMNS:
+            return numpy.float64
+        return FIELD_DTYPES.get(type,object)
+
+    def addColumn(self,id,values,type=None):
+        ''' Add column, converting lists to the numpy dtype of the field type '''
+        if isinstance(values,(numpy.ndarray,StringColumn)):
+            array = values
+        elif type=='string':
+            array = StringColumn.fromList(values)
+        else:
+            dtype = PointDataset.columnDtype(id,type)
+            if dtype is object:
+                # avoid numpy creating nested arrays from sequence values
+                array = numpy.empty(len(values),dtype=object)
+                array[:] = values
+            else:
+                array = numpy.array(values,dtype=dtype)
+
+        if len(self.columns)==0:
+            self.size = len(array)
+        assert len(array)==self.size, 'Column %s length %d != %d' % (id,len(array),self.size)
+
+        self.columns[id] = array
+        self.types[id] = type
+        return array
+
+    def hasColumn(self,id):
+        return id in self.columns
+
+    def column(self,id):
+        return self.columns[id]
+
+    def resolveColumns(self):
+        ''' Plain dict of all columns, view columns resolved against the base dataset once '''
+        columns = self.columns
+        if isinstance(columns,ViewColumns):
+            return dict((id,columns[id]) for id in columns.keys())
+        return dict(columns)
+
+    def setValue(self,id,index,value):
+        ''' Set single value, adding an object column for new ids '''
+        if not id in self.columns:
+            if id in FLOAT_COLUMNS:
+                array = numpy.empty(self.size)
+                array.fill(numpy.nan)
+            else:
+                array = numpy.empty(self.size,dtype=object)
+            self.columns[id] = array
+            self.types[id] = None
+        self.columns[id][index] = value
+
+    def storageArray(self,id):
+        ''' Column as a plain typed array: datetimes as int64 epoch seconds, objects as byte strings '''
+        array = self.columns[id]
+        type = self.types[id]
+        if type=='datetime' or type=='timestamp':
+            array = numpy.array([Utils.utc2epoch(dt) for dt in array],dtype=numpy.int64)
+        elif array.dtype==object:
+            array = numpy.array(array.tolist(),dtype=str)
+        return array
+
+    @staticmethod
+    def fromStorageArray(array,type,epochDates=False):
+        '''
+        Column from an array created by storageArray
+        :return: array, column type
+        '''
+        if type=='datetime' or type=='timestamp':
+            if epochDates:
+                return array,'epoch'
+            return PointDataset.epochToDatetimes(array),type
+        return array,type
+
+    def save(self,filename):
+        '''
+        Save columns to a numpy .npz file
+        String columns are stored as buffer and offsets arrays, other object columns as byte string arrays,
+        datetimes as int64 epoch seconds
+        '''
+        arrays = {}
+        for id in self.columns:
+            column = self.columns[id]
+            if isinstance(column,StringColumn):
+                arrays['col_'+id] = column.buffer
+                arrays['off_'+id] = column.offsets
+            else:
+                arrays['col_'+id] = self.storageArray(id)
+
+        arrays['types'] = numpy.array(json.dumps(self.types))
+
+        # write to temporary file so an interrupted save leaves no partial cache
+        tmpFilename = filename+'.tmp'
+        with open(tmpFilename,'wb') as f:
+            numpy.savez(f,**arrays)
+        os.rename(tmpFilename,filename)
+
+    @staticmethod
+    def load(filename):
+        ''' Load dataset saved by PointDataset.save '''
+        dataset = PointDataset()
+        with numpy.load(filename) as npz:
+            types = json.loads(str(npz['types']))
+            for key in npz.files:
+                if key[:4]!='col_':
+                    continue
+                id = key[4:]
+                if 'off_'+id in npz.files:
+                    dataset.addColumn(id,StringColumn(npz[key],npz['off_'+id]),types[id])
+                else:
+                    array,type = PointDataset.fromStorageArray(npz[key],types[id])
+                    dataset.addColumn(id,array,type)
+        return dataset
+
+    @staticmethod
+    def epochToDatetimes(array):
+        ''' Convert int64 epoch array to object array of UTC datetimes '''
+        dates = numpy.empty(len(array),dtype=object)
+        dates[:] = [Utils.epoch2utc(secs) for secs in array.tolist()]
+        return dates
+
+    def subset(self,rows):
+        ''' New dataset with rows selected by a boolean mask or index array '''
+        dataset = PointDataset()
+        for id in self.columns:
+            dataset.addColumn(id,self.columns[id][rows],self.types[id])
+        return dataset
+
+    def view(self):
+        '''
+        Dataset sharing the columns of this dataset.
+        Columns added to the view, such as layer styles, are only visible in the view.
+        '''
+        view = PointDataset()
+        view.base = self
+        view.columns = ViewColumns(self.columns)
+        view.types = ViewColumns(self.types)
+        view.size = self.size
+        view.timings = self.timings
+        return view
+
+    def validIndices(self):
+        ''' Indices of rows with valid projected coordinates '''
+        if 'valid' in self.columns:
+            return numpy.flatnonzero(self.columns['valid'])
+        return numpy.arange(self.size)
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self,index):
+        if index<0:
+            index += self.size
+        if index<0 or index>=self.size:
+            raise IndexError(index)
+        return DataRow(self,index)
+
+    def __iter__(self):
+        columns = self.resolveColumns()
+        for i in range(0,self.size):
+            yield DataRow(self,i,columns)
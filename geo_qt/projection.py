@@ -0,0 +1,127 @@
+'''
+Projection context shared by a map, its layers and dialogs
+
+ProjectionContext caches Proj objects by proj4 string, memoizes projected bounds
+and provides vectorized forward (lng lat to map) and inverse (map to lng lat) transforms.
+
+'''
+
+import numpy
+import pyproj
+
+from map_utils import MapUtils
+
+
+class ProjectionContext(object):
+
+    def __init__(self,cache=None,fastTransforms=None):
+        # proj4 string -> pyproj.Proj
+        self.projs = {}
+        # (bbox, source srs, map srs) -> projected bbox
+        self.bounds = {}
+        # ProjectionCache for layer coordinate arrays
+        self.cache = cache
+        # FastTransform projections of this map, "fast_projections" in mapOpts
+        self.fastTransforms = tuple(fastTransforms) if fastTransforms!=None else MapUtils.fastTransforms
+        self.epsg4326 = self.getProj('+init=epsg:4326')
+        self.epsg3857 = self.getProj('+init=epsg:3857')
+        # map projection
+        self.proj = None
+
+    def getProj(self,proj):
+        '''
+        Cached Proj for a proj4 string, Proj objects are returned unchanged
+        Raises RuntimeError for invalid proj4 strings
+        '''
+        if isinstance(proj,pyproj.Proj):
+            return proj
+        if not proj in self.projs:
+            self.projs[proj] = pyproj.Proj(proj)
+        return self.projs[proj]
+
+    def setProj(self,proj):
+        ''' Set map projection, returns Proj '''
+        self.proj = self.getProj(proj)
+        return self.proj
+
+    def transform(self,projSrc,projDest,x,y):
+        '''
+        Vectorized transform of coordinate arrays between proj4 strings or Proj objects
+        :return: float64 arrays, nan where the projection failed
+        '''
+        return MapUtils.transformArrays(self.getProj(projSrc),self.getProj(projDest),x,y,self.fastTransforms)
+
+    def transformPoint(self,projSrc,projDest,x,y):
+        ''' Transform single point, returns [x,y] or None if the projection failed '''
+        px,py = self.transform(projSrc,projDest,[x],[y])
+        if numpy.isnan(px[0]):
+            return None
+        return [px.item(0),py.item(0)]
+
+    def forward(self,lng,lat,projSrc=None):
+        ''' Arrays from projSrc, default lng lat, to the map projection '''
+        return self.transform(projSrc or self.epsg4326,self.proj,lng,lat)
+
+    def inverse(self,px,py):
+        ''' Map projection arrays to lng lat '''
+        return self.transform(self.proj,self.epsg4326,px,py)
+
+    def forwardPoint(self,lng,lat,projSrc=None):
+        return self.transformPoint(projSrc or self.epsg4326,self.proj,lng,lat)
+
+    def inversePoint(self,px,py):
+        return self.transformPoint(self.proj,self.epsg4326,px,py)
+
+    def projectArrays(self,projSrc,x,y):
+        ''' Layer coordinate arrays to the map projection, through the projection cache '''
+        projSrc = self.getProj(projSrc)
+        if self.cache==None:
+            return MapUtils.transformArrays(projSrc,self.proj,x,y,self.fastTransforms)
+        return self.cache.transform(projSrc,self.proj,x,y,self.fastTransforms)
+
+    def projectedBounds(self,bbox,projSrc=None,projDest=None):
+        ''' Memoized MapUtils.projectedBounds of bbox, default lng lat to the map projection '''
+        projSrc = self.getProj(projSrc or self.epsg4326)
+        projDest = self.getProj(projDest or self.proj)
+        key = (tuple(bbox),projSrc.srs,projDest.srs)
+        if not key in self.bounds:
+            self.bounds[key] = MapUtils.projectedBounds(projSrc,projDest,bbox)
+        return list(self.bounds[key])
+
+
+class InverseGrid(object):
+    '''
+    Lng lat of view coords on a coarse raster over the canvas, built with one inverse transform.
+    lookup interpolates bilinearly between raster points, for fast approximate mouse readouts.
+    '''
+
+    def __init__(self,map,step=16):
+        self.step = step
+        xs = numpy.arange(0,map.canvasW+step,step,dtype=numpy.float64)
+        ys = numpy.arange(0,map.canvasH+step,step,dtype=numpy.float64)
+        vx,vy = numpy.meshgrid(xs,ys)
+        pc = map.projBounds.getCentre()
+        px = pc[0] + (vx-map.canvasW/2)/map.projToViewScale
+        py = pc[1] - (vy-map.canvasH/2)/map.projToViewScale
+        lng,lat = map.projection.inverse(px.ravel(),py.ravel())
+        # nested lists, scalar lookups on lists are faster than on small numpy slices
+        self.lng = lng.reshape(vx.shape).tolist()
+        self.lat = lat.reshape(vx.shape).tolist()
+
+    def lookup(self,x,y):
+        ''' Interpolated [lng,lat] of view point x,y, None outside the grid, near failed points or across the antimeridian '''
+        fx = float(x)/self.step
+        fy = float(y)/self.step
+        i = int(fx)
+        j = int(fy)
+        if i<0 or j<0 or j+1>=len(self.lng) or i+1>=len(self.lng[0]):
+            return None
+        lngs = (self.lng[j][i],self.lng[j][i+1],self.lng[j+1][i],self.lng[j+1][i+1])
+        lats = (self.lat[j][i],self.lat[j][i+1],self.lat[j+1][i],self.lat[j+1][i+1])
+        # nan != nan
+        if any(v!=v for v in lngs) or max(lngs)-min(lngs)>180:
+            return None
+        tx = fx-i
+        ty = fy-j
+        weights = ((1-tx)*(1-ty),tx*(1-ty),(1-tx)*ty,tx*ty)
+        return [sum(w*v for w,v in zip(weights,lngs)),sum(w*v for w,v in zip(weights,lats))]
@@ -0,0 +1,128 @@
+'''
+Cache of projected coordinate arrays
+
+Projected x,y arrays are keyed on a hash of the source coordinates, the source and
+destination proj4 strings and the enabled FastTransform projections. Recently used results are kept in memory up to a byte limit,
+and with a cache directory every result is also saved as a .npz file, so switching back to
+a projection or restarting with the same data needs no transform work.
+
+'''
+
+import hashlib
+import os
+import time
+from collections import OrderedDict
+
+import numpy
+
+from map_utils import MapUtils
+
+
+class ProjectionCache(object):
+    '''
+    In-memory LRU and optional on-disk cache of MapUtils.transformArrays results
+    Large arrays can be projected with MapUtils.transformArraysParallel
+    '''
+
+    def __init__(self,cacheDir=None,maxBytes=256*1024*1024,parallelThreshold=None,workers=None):
+        # directory of <key>.npz files, None for memory only
+        self.cacheDir = cacheDir
+        # max bytes of results in memory, 0 to disable the memory cache
+        self.maxBytes = maxBytes
+        # bytes of results in memory
+        self.nbytes = 0
+        # arrays with at least parallelThreshold points are projected in a process pool, None to disable
+        self.parallelThreshold = parallelThreshold
+        # number of pool processes, default cpu count
+        self.workers = workers
+        # key -> (px,py), least recently used first
+        self.arrays = OrderedDict()
+
+    @staticmethod
+    def getKey(projSrc,projDest,x,y,fastTransforms):
+        ''' sha1 of the coordinates, the proj4 strings and the FastTransform projections '''
+        h = hashlib.sha1()
+        h.update(projSrc.srs)
+        h.update('|')
+        h.update(projDest.srs)
+        # closed-form and pyproj results differ slightly, so they are cached separately
+        h.update('|'+','.join(fastTransforms)+'|')
+        h.update(numpy.ascontiguousarray(x,dtype=numpy.float64).tostring())
+        h.update(numpy.ascontiguousarray(y,dtype=numpy.float64).tostring())
+        return h.hexdigest()
+
+    def transform(self,projSrc,projDest,x,y,fastTransforms=None):
+        '''
+        Projected coordinate arrays, from the cache or MapUtils.transformArrays
+        Returned arrays are shared between callers and read-only
+        :param fastTransforms: enabled FastTransform projections, default MapUtils.fastTransforms
+        '''
+        if fastTransforms==None:
+            fastTransforms = MapUtils.fastTransforms
+        key = ProjectionCache.getKey(projSrc,projDest,x,y,fastTransforms)
+
+        if key in self.arrays:
+            arrays = self.arrays.pop(key)
+            self.arrays[key] = arrays
+            return arrays
+
+        arrays = self.load(key)
+        if arrays is None:
+            t0 = time.time()
+            if self.parallelThreshold!=None and len(x)>=self.parallelThreshold:
+                arrays = MapUtils.transformArraysParallel(projSrc,projDest,x,y,self.workers,
+                                                          fastTransforms=fastTransforms)
+            else:
+                arrays = MapUtils.transformArrays(projSrc,projDest,x,y,fastTransforms)
+            print ('ProjectionCache transform:', len(x), time.time()-t0)
+            self.save(key,arrays)
+
+        for array in arrays:
+            array.flags.writeable = False
+        self.add(key,arrays)
+        return arrays
+
+    def add(self,key,arrays):
+        ''' Keep arrays in memory, dropping least recently used results above maxBytes '''
+        nbytes = arrays[0].nbytes+arrays[1].nbytes
+        if nbytes>self.maxBytes:
+            return
+        self.arrays[key] = arrays
+        self.nbytes += nbytes
+        while self.nbytes>self.maxBytes:
+            oldKey,oldArrays = self.arrays.popitem(last=False)
+            self.nbytes -= oldArrays[0].nbytes+oldArrays[1].nbytes
+
+    def getFilename(self,key):
+        return os.path.join(self.cacheDir,key+'.npz')
+
+    def load(self,key):
+        if self.cacheDir==None:
+            return None
+        filename = self.getFilename(key)
+        if not os.path.exists(filename):
+            return None
+        t0 = time.time()
+        with numpy.load(filename) as npz:
+            arrays = (npz['px'],npz['py'])
+        print ('ProjectionCache load:', time.time()-t0, filename)
+        return arrays
+
+    def save(self,key,arrays):
+        if self.cacheDir==None:
+            return
+        filename = self.getFilename(key)
+        try:
+            if not os.path.exists(self.cacheDir):
+                os.makedirs(self.cacheDir)
+            # write to temporary file so an interrupted save leaves no partial cache
+            tmpFilename = filename+'.tmp'
+            with open(tmpFilename,'wb') as f:
+                numpy.savez(f,px=arrays[0],py=arrays[1])
+            os.rename(tmpFilename,filename)
+        except (IOError,OSError) as e:
+            print('ProjectionCache not saved:',e)
+
+    def clear(self):
+        self.arrays = OrderedDict()
+        self.nbytes = 0
@@ -0,0 +1,221 @@
+'''
+SQLite point datasource, "datatype":"sqlite"
+
+Layer opts:
+{
+    "datatype":"sqlite",
+    "path":<path>,
+    "files":[<SQLite database file>],
+    "table":<table name>,
+    "fields":[
+        {"id":<id>, "field":<column in table>, "type":<data type>, "name":<name>},
+    ],
+    "bounds":<optional lng lat bounds l,b,r,t>,
+    "date_field":<id of the field filtered by animation min_date and max_date, default "created">,
+    "orderby":<optional id of the field rows are sorted by>
+}
+
+The map bounds, the layer bounds and the animation min_date/max_date are added to the
+WHERE clause, so only rows in the visible area and time range are read into Python.
+Queries use an index on (lat,lng) and on the date column, SQLiteSource.write creates both.
+Rows are returned sorted by the "orderby" field, or the date field with animation opts,
+otherwise in table rowid order, as timeline layers search and draw rows in file order.
+
+Date columns hold text in the field format for "datetime" fields, which must sort
+chronologically such as %Y-%m-%d %H:%M:%S, and integer epoch seconds for "timestamp" fields.
+
+'''
+
+import os
+import sqlite3
+import time
+
+from loader_utils import LoaderUtils, DATE_TYPES
+from point_dataset import StringColumn
+from utils import Utils
+
+# SQLite column type for each loader field type
+SQL_TYPES = {
+    'int':'INTEGER',
+    'float':'REAL',
+    'string':'TEXT',
+    'datetime':'TEXT',
+    'timestamp':'INTEGER'
+}
+
+
+class SQLiteSource(object):
+
+    @staticmethod
+    def quote(name):
+        return '"'+name.replace('"','""')+'"'
+
+    @staticmethod
+    def getDateField(params):
+        ''' Date field filtered by the animation date range, None without animation opts '''
+        if not 'animation' in params:
+            return None
+        dateId = params.get('date_field','created')
+        for fieldData in params['fields']:
+            if fieldData['id']==dateId and fieldData['type'] in DATE_TYPES:
+                return fieldData
+        return None
+
+    @staticmethod
+    def getOrderField(params):
+        ''' Field rows are sorted by, the "orderby" field or the animation date field '''
+        orderId = params.get('orderby')
+        if orderId==None and 'animation' in params:
+            orderId = params.get('date_field','created')
+        for fieldData in params['fields']:
+            if fieldData['id']==orderId:
+                return fieldData
+        return None
+
+    @staticmethod
+    def dateValue(fieldData,dt):
+        ''' Datetime as stored in the date column '''
+        if fieldData['type']=='timestamp':
+            return Utils.utc2epoch(dt)
+        return dt.strftime(fieldData['format'])
+
+    @staticmethod
+    def getQuery(params,bounds=None):
+        '''
+        SELECT statement and parameters for the layer fields, bounds and animation date range
+        :param bounds: map lng lat bounds l,b,r,t, intersected with the layer bounds
+        '''
+        fields = params['fields']
+        fieldsById = dict((fieldData['id'],fieldData) for fieldData in fields)
+        columns = ','.join(SQLiteSource.quote(fieldData['field']) for fieldData in fields)
+        sql = 'SELECT '+columns+' FROM '+SQLiteSource.quote(params['table'])
+
+        where = []
+        args = []
+        boundsList = [layerBounds for layerBounds in (params.get('bounds'),bounds) if layerBounds]
+        if boundsList:
+            # intersection of layer and map bounds
+            l = max(layerBounds[0] for layerBounds in boundsList)
+            b = max(layerBounds[1] for layerBounds in boundsList)
+            r = min(layerBounds[2] for layerBounds in boundsList)
+            t = min(layerBounds[3] for layerBounds in boundsList)
+            # lat first to match the (lat,lng) index
+            where.append(SQLiteSource.quote(fieldsById['lat']['field'])+' BETWEEN ? AND ?')
+            where.append(SQLiteSource.quote(fieldsById['lng']['field'])+' BETWEEN ? AND ?')
+            args += [b,t,l,r]
+
+        dateField = SQLiteSource.getDateField(params)
+        if dateField:
+            minDate = Utils.str2utc(params['animation']['min_date'])
+            maxDate = Utils.str2utc(params['animation']['max_date'])
+            where.append(SQLiteSource.quote(dateField['field'])+' BETWEEN ? AND ?')
+            args += [SQLiteSource.dateValue(dateField,minDate),SQLiteSource.dateValue(dateField,maxDate)]
+
+        if where:
+            sql += ' WHERE '+' AND '.join(where)
+
+        # without ORDER BY rows come back in the order of the index used by the WHERE clause
+        orderField = SQLiteSource.getOrderField(params)
+        if orderField:
+            sql += ' ORDER BY '+SQLiteSource.quote(orderField['field'])+',rowid'
+        else:
+            sql += ' ORDER BY rowid'
+        return sql,args
+
+    @staticmethod
+    def convertColumn(values,fieldData):
+        ''' Convert SQLite values to loader column values, NULL as in CSV files '''
+        type = fieldData['type']
+        if type=='int':
+            return [0 if v is None else int(v) for v in values]
+        elif type=='float':
+            return [0.0 if v is None else float(v) for v in values]
+        elif type in DATE_TYPES:
+            # date strings for LoaderUtils.convertDates
+            return ['' if v is None else str(v) for v in values]
+        return ['' if v is None else (v.encode('utf8') if isinstance(v,unicode) else str(v)) for v in values]
+
+    @staticmethod
+    def load(params,bounds=None,batchSize=100000):
+        '''
+        Load layer dataset with an indexed query of each database in params["files"]
+        :param bounds: map lng lat bounds l,b,r,t
+        '''
+        t0 = time.time()
+        fields = params['fields']
+        sql,args = SQLiteSource.getQuery(params,bounds)
+
+        lists = dict((fieldData['id'],[]) for fieldData in fields)
+        for filename in params['files']:
+            file = params['path']+filename
+            if not os.path.exists(file):
+                # sqlite3.connect would create an empty database
+                raise IOError('SQLite database not found: '+file)
+            conn = sqlite3.connect(file)
+            try:
+                cursor = conn.execute(sql,args)
+                while True:
+                    rows = cursor.fetchmany(batchSize)
+                    if not rows:
+                        break
+                    for fieldData,values in zip(fields,zip(*rows)):
+                        lists[fieldData['id']].extend(SQLiteSource.convertColumn(values,fieldData))
+            finally:
+                conn.close()
+
+        dataset = LoaderUtils.createDataset(fields,lists,params.get('epoch_dates',False))
+        print ('SQLiteSource load:', len(dataset), time.time()-t0)
+        return dataset
+
+    @staticmethod
+    def createIndexes(conn,table,fields,dateId='created'):
+        ''' Create the (lat,lng) and date indexes used by load queries '''
+        fieldsById = dict((fieldData['id'],fieldData) for fieldData in fields)
+        conn.execute('CREATE INDEX IF NOT EXISTS '+SQLiteSource.quote(table+'_lat_lng')+' ON '+SQLiteSource.quote(table)+
+                     ' ('+SQLiteSource.quote(fieldsById['lat']['field'])+','+SQLiteSource.quote(fieldsById['lng']['field'])+')')
+        if dateId in fieldsById:
+            conn.execute('CREATE INDEX IF NOT EXISTS '+SQLiteSource.quote(table+'_'+dateId)+' ON '+SQLiteSource.quote(table)+
+                         ' ('+SQLiteSource.quote(fieldsById[dateId]['field'])+')')
+
+    @staticmethod
+    def write(dataset,file,table,fields,dateId='created'):
+        '''
+        Write dataset loaded with fields to a new SQLite table with load indexes
+        Datetime columns are written as text in the field format, timestamps as epoch seconds
+        '''
+        t0 = time.time()
+        columns = []
+        for fieldData in fields:
+            column = dataset.column(fieldData['id'])
+            type = fieldData['type']
+            if isinstance(column,StringColumn):
+                values = [s.decode('utf8','replace') for s in column]
+            elif type in DATE_TYPES:
+                values = SQLiteSource.dateStrings(column,dataset.types[fieldData['id']],fieldData)
+            else:
+                values = column.tolist()
+            columns.append(values)
+
+        conn = sqlite3.connect(file)
+        try:
+            definitions = ','.join(SQLiteSource.quote(fieldData['field'])+' '+SQL_TYPES.get(fieldData['type'],'TEXT') for fieldData in fields)
+            conn.execute('CREATE TABLE '+SQLiteSource.quote(table)+' ('+definitions+')')
+            placeholders = ','.join('?'*len(fields))
+            conn.executemany('INSERT INTO '+SQLiteSource.quote(table)+' VALUES ('+placeholders+')',zip(*columns))
+            SQLiteSource.createIndexes(conn,table,fields,dateId)
+            conn.commit()
+        finally:
+            conn.close()
+        print ('SQLiteSource write:', len(dataset), time.time()-t0, file)
+
+    @staticmethod
+    def dateStrings(column,columnType,fieldData):
+        ''' Date column values as stored in SQLite, from datetimes or epoch seconds '''
+        if columnType=='epoch':
+            epoch = column.tolist()
+        else:
+            epoch = [Utils.utc2epoch(dt) for dt in column]
+        if fieldData['type']=='timestamp':
+            return epoch
+        format = fieldData['format']
+        return [time.strftime(format,time.gmtime(secs)) for secs in epoch]
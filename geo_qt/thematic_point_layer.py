@@ -61,10 +61,20 @@ random font color between two hex values, constant font alpha
 '''
 
 import colorsys
-import random
 import string
 
 from map_qt import *
+from point_dataset import DataRow, StringColumn
+
+# feature style property and style list interpolated for each thematic style
+STYLE_VALUES = {
+    'font-size':('fontSize','sizes'),
+    'font-alpha':('fontAlpha','alphas'),
+    'font-color':('fontColor','hsvColors'),
+    'point-size':('ptSize','sizes'),
+    'point-alpha':('ptAlpha','alphas'),
+    'point-color':('ptColor','hsvColors')
+}
 
 
 class ThematicPointLayer(PointDataLayer):
@@ -73,23 +83,41 @@ class ThematicPointLayer(PointDataLayer):
         self.pStyles = None
         self.defaultFeatureStyles = {}
         self.thematicStyles = []
+        # truncated text cache, {textLength:{item index:text}} for textCacheData
+        self.textLength = 2
+        self.textCache = {}
+        self.textCacheData = None
         super(ThematicPointLayer,self).__init__(map, opts)
 
     def loadData(self):
         super(ThematicPointLayer,self).loadData()
-        for item in self.data:
-            # Add Feature styles dict to DataItem
-            item.fs = {}
+        self.processStyles()
 
+    def prepareBatch(self):
+        ''' Style streamed batch '''
         self.processStyles()
 
     def setTextLength(self,length):
-        for item in self.data:
-            item.text = item.title.decode('utf8')
-            idx = string.rfind(item.text,' ',0,length)
+        ''' Set label length, text is decoded and truncated when items are drawn '''
+        self.textLength = length
+
+    def getItemText(self,item):
+        ''' Decoded title truncated to textLength, cached per textLength value '''
+        if self.textCacheData is not self.data:
+            self.textCache = {}
+            self.textCacheData = self.data
+
+        cache = self.textCache.setdefault(self.textLength,{})
+        text = cache.get(item.index)
+        if text==None:
+            length = self.textLength
+            text = item.title.decode('utf8')
+            idx = string.rfind(text,' ',0,length)
             if idx==-1:
                 idx = length
-            item.text = item.text[:idx]
+            text = text[:idx]
+            cache[item.index] = text
+        return text
 
     def setStyles(self,styles):
         ''' Upate styles dict and render '''
@@ -223,99 +251,97 @@ class ThematicPointLayer(PointDataLayer):
 
 
 
-    def setFeatureStyles(self,styles,item):
-            ''' Add styles to individual data items '''
-            item.fs = {}
-            fs = item.fs
-
-            for styleId in styles:
-                style = styles[styleId]
-
-                if type(style) is dict:
-
-                    norm = 0.0
-                    idx0 = 0
-                    idx1 = 1
-                    if 'property' in style:
-                        p = style['property']
-                        d = getattr(item, p)
-                        if type(d)==str:
-                            idx0 = style['values'].index(d) if d in style['values'] else len(style['values'])
-                        else:
-                            norm,idx0 = Utils.interpParams(d,style['values'])
-
-                        if norm == 0.0:
-                            idx1 = idx0
-                        else:
-                            idx1 = idx0+1
-
-                    elif 'fn' in style:
-                        if style['fn']=='random':
-                            norm = random.random()
-                            idx0 = 0
-                            idx1 = 1
-
-                    s = styleId
-                    if s=="font-size":
-                        if 'sizes' in style:
-                            fs['fontSize'] = Utils.interp(norm,style['sizes'][idx0],style['sizes'][idx1])
-
-
-                    elif s=="font-alpha":
-                        if 'alphas' in style:
-                            fs['fontAlpha'] = Utils.interp(norm,style['alphas'][idx0],style['alphas'][idx1])
-                            if not 'fontColor' in fs:
-                                fs['fontColor'] = QColor()
-                            fs['fontColor'].setAlphaF(fs['fontAlpha'])
-
-                    elif s=="font-color":
-                        if 'colors' in style:
-                            hsv = Utils.interpHSV(norm,style['hsvColors'][idx0],style['hsvColors'][idx1])
-                            if not 'fontColor' in fs:
-                                fs['fontColor'] = QColor()
-                                if not 'fontAlpha' in fs:
-                                    fs['fontAlpha'] = self.defaultFeatureStyles['fontAlpha']
-                            fs['fontColor'].setHsv(hsv[0], hsv[1], hsv[2], fs['fontAlpha']*255)
-
-                    elif s=="point-size":
-                        if 'sizes' in style:
-                            fs['ptSize'] = Utils.interp(norm,style['sizes'][idx0],style['sizes'][idx1])
-
-                    elif s=="point-alpha":
-                        if 'alphas' in style:
-                            fs['ptAlpha'] = Utils.interp(norm,style['alphas'][idx0],style['alphas'][idx1])
-                            if not 'ptColor' in fs:
-                                fs['ptColor'] = QColor()
-                            fs['ptColor'].setAlphaF(fs['ptAlpha'])
-
-                    elif s=="point-color":
-                        if 'colors' in style:
-                            hsv = Utils.interpHSV(norm,style['hsvColors'][idx0],style['hsvColors'][idx1])
-                            if not 'ptColor' in fs:
-                                fs['ptColor'] = QColor()
-                                if not 'ptAlpha' in fs:
-                                    fs['ptAlpha'] = self.defaultFeatureStyles['ptAlpha']
-                            fs['ptColor'].setHsv(hsv[0], hsv[1], hsv[2], fs['ptAlpha']*255)
-
-
+    def getStyleValues(self,style,outputs):
+        '''
+        Style outputs for each row, interpolated by the style "property" column or random with "fn":"random"
+        String properties select the output of their index in "values"
+        :param outputs: style sizes, alphas or hsvColors list
+        :return: float array, one row of h,s,v per data row for colours
+        '''
+        n = len(self.data)
+        outputs = numpy.array(outputs,dtype=numpy.float64)
+        if 'property' in style:
+            column = self.data.column(style['property'])
+            values = style['values']
+            if isinstance(column,StringColumn) or (column.dtype==object and n>0 and type(column[0])==str):
+                lookup = dict((value,i) for i,value in enumerate(values))
+                idx = numpy.fromiter((lookup.get(d,len(values)) for d in column),dtype=numpy.int64,count=n)
+                return outputs[idx]
+            # piecewise linear in values, clamped at the first and last value
+            d = numpy.asarray(column,dtype=numpy.float64)
+            outputs = outputs[:len(values)]
+            if outputs.ndim==1:
+                return numpy.interp(d,values,outputs)
+            return numpy.column_stack([numpy.interp(d,values,outputs[:,c]) for c in range(0,outputs.shape[1])])
+
+        norm = numpy.zeros(n)
+        if style.get('fn')=='random':
+            norm = numpy.random.random(n)
+        if outputs.ndim==1:
+            return outputs[0]+(outputs[1]-outputs[0])*norm
+        return outputs[0]+(outputs[1]-outputs[0])*norm[:,numpy.newaxis]
 
     def setDataStyles(self):
-        ''' Add styles to dataset '''
-        items = self.data
-        nItems = len(items)
+        '''
+        Add a column of feature style values to the dataset for each thematic style,
+        "fs_<property>" such as fs_ptSize, colours are int h,s,v rows
+        '''
         t0 = time.time()
+        for styleId in self.pStyles:
+            style = self.pStyles[styleId]
+            if type(style) is dict and styleId in STYLE_VALUES:
+                prop,key = STYLE_VALUES[styleId]
+                if key in style:
+                    values = self.getStyleValues(style,style[key])
+                    if values.ndim==2:
+                        values = values.astype(numpy.int64)
+                    self.data.addColumn('fs_'+prop,values)
+        print('Set styles:',time.time()-t0)
+
+    def getRenderIndices(self):
+        '''
+        Indices of rows in the getItemIndices range to render
+        Rows are filtered with filterIndices, or one row at a time with filterItem
+        when a subclass overrides filterItem but not filterIndices
+        '''
+        start,end = self.getItemIndices()
+        indices = numpy.arange(start,end)
+        if self.usesFilterItem():
+            data = self.data
+            columns = data.resolveColumns()
+            rows = [i for i in indices.tolist() if self.filterItem(DataRow(data,i,columns))]
+            return numpy.array(rows,dtype=numpy.int64)
+        if self.data.hasColumn('valid'):
+            indices = indices[self.data.column('valid')[start:end]]
+        return self.filterIndices(indices)
+
+    def usesFilterItem(self):
+        ''' True if the most derived of filterItem and filterIndices is filterItem '''
+        for cls in type(self).__mro__:
+            if 'filterIndices' in cls.__dict__:
+                return False
+            if 'filterItem' in cls.__dict__:
+                return True
+        return False
+
+    def filterIndices(self,indices):
+        ''' Filter indices of rows with valid coords to render, vectorized filterItem '''
+        return indices
 
-        for i in range(0,nItems):
-            item = items[i]
-            if i%1000 == 0 or i == nItems-1:
-                self.progress("Set styles:",t0,i,nItems-1)
-
-            # if self.map.lngLatBounds.within(item.lng,item.lat):
-            # if item.vx and item.vy:
-
-            self.setFeatureStyles(self.pStyles,item)
-
+    def filterItem(self,item):
+        ''' Row filter, override filterIndices for the vectorized filter '''
+        b = item.valid #self.map.lngLatBounds.within(item.lng,item.lat)
+        return b
 
+    @staticmethod
+    def firstAtPixel(vx,vy,indices):
+        ''' Indices of the first row drawn at each integer view coord '''
+        if len(indices)==0:
+            # numpy.unique with axis fails on empty arrays
+            return indices
+        pixels = numpy.column_stack((vx[indices].astype(numpy.int64),vy[indices].astype(numpy.int64)))
+        first = numpy.unique(pixels,axis=0,return_index=True)[1]
+        return indices[numpy.sort(first)]
 
     def render(self,qp):
         ''' Render data '''
@@ -324,8 +350,6 @@ class ThematicPointLayer(PointDataLayer):
             self.renderGrid(qp)
             return
 
-        items = self.data
-        nItems = len(items)
         t0 = time.time()
 
         qp.setCompositionMode(QPainter.CompositionMode_SourceOver)
@@ -336,43 +360,62 @@ class ThematicPointLayer(PointDataLayer):
             self.font = QFont(family, self.defaultFeatureStyles['fontSize'], weight)
             qp.setFont(self.font)
 
-        fs = copy.deepcopy(self.defaultFeatureStyles)
-        coords = {}
-
         isOverlay = True
         if 'overlay-enabled' in self.styles:
             if int(self.styles['overlay-enabled'])==0:
                 isOverlay = False
 
-        for i in range(0,nItems):
-            item = items[i]
-            if i%1000 == 0 or i == nItems-1:
-                self.progress("Render data:",t0,i,nItems-1)
-
-            if self.filterItem(item):
-
-                coordStr = str(int(item.vx))+'_'+str(int(item.vy))
-                if not (coordStr in coords) or isOverlay:
-                    coords[coordStr]=1
-
-                    for styleId in self.thematicStyles:
-                        if styleId in item.fs:
-                            fs[styleId] = item.fs[styleId]
-
-                    self.renderFeature(qp,item,fs,1.0)
+        indices = self.getRenderIndices()
+        if not isOverlay:
+            indices = ThematicPointLayer.firstAtPixel(self.data.column('vx'),self.data.column('vy'),indices)
 
+        self.renderRows(qp,indices,None,t0)
 
         t1 = time.time()
         print('Data Render:',t1-t0)
 
+    def renderRows(self,qp,indices,alphas,t0):
+        '''
+        Render rows at indices with the default and thematic feature styles
+        :param alphas: alpha multiplier array used by timeline, None for 1.0
+        '''
+        data = self.data
+        fs = copy.deepcopy(self.defaultFeatureStyles)
+
+        # columns are resolved and style columns converted to lists once per pass
+        columns = data.resolveColumns()
+        styleValues = []
+        for prop in self.thematicStyles:
+            if data.hasColumn('fs_'+prop):
+                values = data.column('fs_'+prop)[indices]
+                isColor = values.ndim==2
+                if isColor:
+                    # colours are set on one QColor per style
+                    fs[prop] = QColor()
+                styleValues.append((prop,values.tolist(),isColor))
+        alphas = [1.0]*len(indices) if alphas is None else alphas.tolist()
+        rows = indices.tolist()
+
+        nItems = len(rows)
+        for k in range(0,nItems):
+            if k%1000 == 0 or k == nItems-1:
+                self.progress("Render data:",t0,k,nItems-1)
+
+            for prop,values,isColor in styleValues:
+                if isColor:
+                    h,s,v = values[k]
+                    fs[prop].setHsv(h,s,v)
+                else:
+                    fs[prop] = values[k]
 
+            self.renderFeature(qp,DataRow(data,rows[k],columns),fs,alphas[k])
 
     def renderFeature(self,qp,item,fs,alpha):
         '''
         Render text and or point
         :param qp: QPainter
-        :param item: DataItem
-        :param fs: Combined default and DateItem styles
+        :param item: DataRow
+        :param fs: Combined default and row styles
         :param alpha: alpha multiplier used by timeline
         '''
         if fs['isText']:
@@ -386,6 +429,9 @@ class ThematicPointLayer(PointDataLayer):
 
         textW = 1000
         textH = 400
+        text = self.getItemText(item)
+        x = item.vx
+        y = item.vy
 
         a =  fs['fontAlpha']
         a*=alpha
@@ -396,19 +442,19 @@ class ThematicPointLayer(PointDataLayer):
         if fs['fontLineWidth']>0.0 and fs['fontSize'] > fs['fontLineThresh']:
 
             fm = QFontMetrics(self.font)
-            pixW = fm.width(item.text)
+            pixW = fm.width(text)
             pixH = fm.height()
 
             # background rect
             # if alpha>0.7:
             #     qp.setPen(Qt.NoPen)
             #     qp.setBrush(QColor(255,255,255,220))
-            #     qp.drawRect(item.vx-pixW/2,item.vy+3-pixH/2,pixW,pixH)
+            #     qp.drawRect(x-pixW/2,y+3-pixH/2,pixW,pixH)
 
 
             self.font.setStyleStrategy(QFont.ForceOutline)
             path = QPainterPath()
-            path.addText(item.vx-pixW/2,item.vy+pixH/2, self.font, item.text)
+            path.addText(x-pixW/2,y+pixH/2, self.font, text)
             fs['fontLineColor'].setAlphaF(a)
             qp.setPen(QPen(fs['fontLineColor'],fs['fontLineWidth']))
             qp.setBrush(fs['fontColor'])
@@ -418,11 +464,13 @@ class ThematicPointLayer(PointDataLayer):
         else:
             qp.setPen(fs['fontColor'])
             qp.setFont(self.font)
-            qp.drawText(QRect(item.vx-textW/2, item.vy-textH/2,textW,textH), Qt.AlignCenter,item.text)
+            qp.drawText(QRect(x-textW/2, y-textH/2,textW,textH), Qt.AlignCenter,text)
 
 
     def renderPoint(self,qp,item,fs,alpha):
 
+        x = item.vx
+        y = item.vy
         if fs['ptLineWidth']>0.0:
             qp.setPen(QPen(fs['ptLineColor'],fs['ptLineWidth']))
         else:
@@ -434,15 +482,11 @@ class ThematicPointLayer(PointDataLayer):
         qp.setBrush(fs['ptColor'])
 
         if fs['ptSize']>2:
-            qp.drawEllipse(item.vx, item.vy, fs['ptSize'], fs['ptSize'])
+            qp.drawEllipse(x, y, fs['ptSize'], fs['ptSize'])
         else:
-            qp.drawRect(QRectF(int(item.vx-fs['ptSize']/2), int(item.vy-fs['ptSize']/2), fs['ptSize'], fs['ptSize']))
+            qp.drawRect(QRectF(int(x-fs['ptSize']/2), int(y-fs['ptSize']/2), fs['ptSize'], fs['ptSize']))
 
 
-    def filterItem(self,item):
-        b = item.vx and item.vy #self.map.lngLatBounds.within(item.lng,item.lat)
-        return b
-
     def getItemIndices(self):
         indices = [0,len(self.data)]
         return indices
@@ -451,8 +495,6 @@ class ThematicPointLayer(PointDataLayer):
         ''' Render projected geometry using option styles. Override for custom styles and rendering. '''
 
         t0 = time.time()
-        items = self.data
-        nItems = len(items)
 
         qp.setCompositionMode(QPainter.CompositionMode_SourceOver)
 
@@ -485,29 +527,19 @@ class ThematicPointLayer(PointDataLayer):
         nColors = len(colors)
         qp.setPen(Qt.NoPen)
 
-        coords={}
-
-        indices = self.getItemIndices()
-
-        for i in range(indices[0],indices[1]):
-            item = items[i]
-            if i%1000 == 0 or i == nItems-1:
-                self.progress("Render data:",t0,i,nItems-1)
-
-
-            if self.filterItem(item):
-                coordStr = str(int(item.vx/ptSize))+'_'+str(int(item.vy/ptSize))
-                if not (coordStr in coords):
-                    coords[coordStr]=1
-                else:
-                    coords[coordStr]+=1
+        # number of rows in each grid cell, cells are view coords divided by ptSize
+        indices = self.getRenderIndices()
+        cellX = (self.data.column('vx')[indices]/ptSize).astype(numpy.int64)
+        cellY = (self.data.column('vy')[indices]/ptSize).astype(numpy.int64)
+        cells = numpy.zeros((0,2),dtype=numpy.int64)
+        counts = numpy.zeros(0,dtype=numpy.int64)
+        if len(indices)>0:
+            cells,counts = numpy.unique(numpy.column_stack((cellX,cellY)),axis=0,return_counts=True)
 
         valFreq = [0] * len(values)
-        for coord in coords:
-            val = coords[coord]
-            pt = coord.split('_')
-            px = int(float(pt[0])*ptSize)
-            py = int(float(pt[1])*ptSize)
+        for (cx,cy),val in zip(cells.tolist(),counts.tolist()):
+            px = int(cx*ptSize)
+            py = int(cy*ptSize)
 
             col = colors[-1]
             idx = len(values)-1
@@ -19,48 +19,98 @@ class TimelineDataLayer(ThematicPointLayer):
     def __init__(self,map,opts):
         self.dataMinDate = None
         self.dataMaxDate = None
+        # Keep item.created as int64 epoch seconds, "epoch_dates" loader option
+        self.epochDates = opts.get('epoch_dates',False)
+        # view date range in epoch seconds
+        self.viewMinValue = None
+        self.viewMaxValue = None
         super(TimelineDataLayer,self).__init__(map, opts)
 
 
     def loadData(self):
         ''' Override includes calculation of min and max data date range '''
-        datatype = self.opts['datatype']
-        if datatype == "csv":
-            self.data = LoaderUtils.loadCSV(self.opts)
+        self.data = self.loadDataset()
 
-        items = self.data
-        nItems = len(items)
+        self.dataMinDate = None
+        self.dataMaxDate = None
+        self.updateDataDateRange(self.data)
 
+        self.processStyles()
+
+    def updateDataDateRange(self,items):
+        ''' Extend data date range with item dates between the animation min and max dates '''
         optMinDate = Utils.str2utc(self.opts["animation"]["min_date"])
         optMaxDate = Utils.str2utc(self.opts["animation"]["max_date"])
         # "max_date":"2015-01-01 00:00:00",
 
-        maxDate = Utils.str2utc('2000-01-01','%Y-%m-%d')
-        minDate = datetime.now(UTC())
-        for i in range(0,nItems):
-            item = items[i]
-            item.fs = {}
-            if item.created<minDate and item.created>=optMinDate:
-                minDate = item.created
-            if item.created>maxDate and item.created<=optMaxDate:
-                maxDate = item.created
+        maxDate = self.dataMaxDate
+        if maxDate==None:
+            maxDate = Utils.str2utc('2000-01-01','%Y-%m-%d')
+        minDate = self.dataMinDate
+        if minDate==None:
+            minDate = datetime.now(UTC())
+
+        created = items.column('created')
+        if self.epochDates:
+            inRange = created[(created>=Utils.utc2epoch(optMinDate)) & (created<=Utils.utc2epoch(optMaxDate))]
+        else:
+            # elementwise datetime comparison of the object column
+            inRange = created[(created>=optMinDate) & (created<=optMaxDate)]
+        if len(inRange)>0:
+            rangeMin = inRange.min()
+            rangeMax = inRange.max()
+            if self.epochDates:
+                rangeMin = Utils.epoch2utc(int(rangeMin))
+                rangeMax = Utils.epoch2utc(int(rangeMax))
+            minDate = min(minDate,rangeMin)
+            maxDate = max(maxDate,rangeMax)
 
         self.dataMinDate = copy.deepcopy(minDate)
         self.dataMaxDate = copy.deepcopy(maxDate)
 
-        self.processStyles()
+    def appendData(self,batch):
+        ''' Override extends data date range with followed rows '''
+        self.updateDataDateRange(batch)
+        super(TimelineDataLayer,self).appendData(batch)
+        if getattr(self.map,'dateRangeCallback',None):
+            self.map.dateRangeCallback(self.dataMinDate,self.dataMaxDate)
+
+    def getCreatedEpoch(self):
+        '''
+        created column of the data as int64 epoch seconds
+        Datetimes are converted once and kept in a createdEpoch column
+        '''
+        data = self.data
+        if self.epochDates:
+            return data.column('created')
+        if not data.hasColumn('createdEpoch'):
+            created = data.column('created')
+            data.addColumn('createdEpoch',numpy.fromiter((Utils.utc2epoch(dt) for dt in created),dtype=numpy.int64,count=len(created)))
+        return data.column('createdEpoch')
+
+    def dateValue(self,dt):
+        ''' Datetime as epoch seconds, comparable with getCreatedEpoch values '''
+        return Utils.utc2epoch(dt)+dt.microsecond/1e6
+
+    def updateViewDateRange(self):
+        self.viewMinValue = self.dateValue(self.map.viewMinDate)
+        self.viewMaxValue = self.dateValue(self.map.viewMaxDate)
+
+    def filterIndices(self,indices):
+        ''' Rows with created in the view date range '''
+        created = self.getCreatedEpoch()[indices]
+        return indices[(created>self.viewMinValue) & (created<self.viewMaxValue)]
 
     def filterItem(self,item):
-        # b =  self.map.lngLatBounds.within(item.lng,item.lat) and item.created>self.map.viewMinDate and item.created<self.map.viewMaxDate
-        b = item.vx and item.vy and item.created>self.map.viewMinDate and item.created<self.map.viewMaxDate
-        return b
+        created = self.getCreatedEpoch()[item.index]
+        return item.valid and created>self.viewMinValue and created<self.viewMaxValue
 
     def getItemIndices(self):
         indices = [0,len(self.data)]
         # if data ordered by date, find min and max indices
         if 'orderby' in self.opts:
             if self.opts['orderby']=='created':
-                indices = self.getFeatureIndicesByDate([self.map.viewMinDate, self.map.viewMaxDate])
+                indices = self.getFeatureIndicesByDate([self.viewMinValue, self.viewMaxValue])
                 if indices[0]==-1:
                     indices=[0,0]
                 else:
@@ -74,12 +124,12 @@ class TimelineDataLayer(ThematicPointLayer):
         if self.map.viewMinDate == None:
             return
 
+        self.updateViewDateRange()
+
         if 'grid' in self.styles:
             self.renderGrid(qp)
             return
 
-        items = self.data
-        nItems = len(items)
         t0 = time.time()
         qp.setCompositionMode(QPainter.CompositionMode_SourceOver)
 
@@ -93,123 +143,38 @@ class TimelineDataLayer(ThematicPointLayer):
         if 'transition-fraction' in self.styles:
             tf = self.styles['transition-fraction']
 
-        minDate = self.map.viewMinDate
-        maxDate = self.map.viewMaxDate
-
-        viewSecs = (maxDate-minDate).total_seconds()
-
-        fs = copy.deepcopy(self.defaultFeatureStyles)
-        coords = {}
+        viewSecs = self.viewMaxValue-self.viewMinValue
 
-        indices = self.getItemIndices()
+        # Overlap cull causes features to appear and disappear between frames, so all rows in range are drawn
+        indices = self.getRenderIndices()
 
-        for i in range(indices[0],indices[1]):
-            item = items[i]
-            if i%1000 == 0:
-                self.progress("Render data:",t0,i,nItems)
+        # alpha as function of date range and created column, faded in and out over the transition fraction
+        n = (self.getCreatedEpoch()[indices]-self.viewMinValue)/viewSecs
+        alphas = numpy.ones(len(indices))
+        fadeIn = n<tf
+        fadeOut = ~fadeIn & (n>1.0-tf)
+        alphas[fadeIn] = numpy.sin(n[fadeIn]*0.5*math.pi/tf) # [0,0.5]
+        alphas[fadeOut] = numpy.sin(((n[fadeOut]-(1.0-tf))/tf*0.5+0.5)*math.pi) # [0.5,1.0]
 
-            # if item.created>minDate and item.created<maxDate:
-                # if self.map.lngLatBounds.within(item.lng,item.lat):
-                # if item.vx and item.vy:
-            if self.filterItem(item):
-
-                # Overlap cull causes features to appear and disappear between frames - fix by pre-culling
-                # coordStr = str(int(item.vx))+'_'+str(int(item.vy))
-                # if not (coordStr in coords):
-                # coords[coordStr]=1
-
-                # Find alpha as function of date range and DataItem.created property
-                itemSecs = (item.created-minDate).total_seconds()
-                n = float(itemSecs)/viewSecs
-                # alpha = math.sin(n*math.pi)
-                alpha = 1.0
-                # transition fraction
-
-                if n<tf:
-                    alpha = math.sin(n*0.5*math.pi/tf) # [0,0.5]
-                elif n>1.0-tf:
-                    alpha = math.sin(((n-(1.0-tf))/tf*0.5+0.5)*math.pi) # [0.5,1.0]
-
-                for styleId in self.thematicStyles:
-                    if styleId in item.fs:
-                        fs[styleId] = item.fs[styleId]
-
-                self.renderFeature(qp,item,fs,alpha)
+        self.renderRows(qp,indices,alphas,t0)
 
         t1 = time.time()
         print('Data Render:',t1-t0)
 
 
     def getFeatureIndicesByDate(self,dateValues):
-        items = self.data
-        # nItems = len(items)
-        retIndices = [-1, -1]
-        if items[0].created > dateValues[1] or items[-1].created < dateValues[0]:
-            return retIndices
-
-        elif dateValues[0] == dateValues[1]:
-            return retIndices
-
-        else:
-            retIndices[0] = self.getFeatureIndexByDate(dateValues[0], "gte")
-            retIndices[1] = self.getFeatureIndexByDate(dateValues[1], "lte")
-            if retIndices[1] < retIndices[0]:
-                retIndices = [-1, -1]
-                return retIndices
-
-        return retIndices
-
-
-    def getFeatureIndexByDate(self,dateValue, funcStr):
-
-        items = self.data
-        nItems = len(items)
-        retVal = 0
-        if items[0].created >= dateValue:
-            retVal = 0
-
-        elif items[-1].created <= dateValue:
-            retVal = nItems - 1
-
-        else:
-            bFound = False
-            count = 0
-            curIndex = int(math.floor(nItems / 2))
-            inc = int(nItems / 2)
-            while bFound == False and count < 100:
-                inc = int(math.floor(inc / 2))
-                inc = max(inc, 1)
-
-                if items[curIndex].created == dateValue:
-                    bFound = True
-
-                elif curIndex == nItems - 1:
-                    if (funcStr == "lte"):
-                        curIndex = nItems - 2
-                    bFound = True
-
-                elif curIndex == 0:
-                    if funcStr == "gte":
-                        curIndex = 1
-                    bFound = True
-
-                elif items[curIndex].created < dateValue and items[curIndex + 1].created > dateValue:
-                    if funcStr == "gte":
-                        curIndex += 1
-                    bFound = True
-
-                elif items[curIndex].created < dateValue:
-                    curIndex += inc
-
-                else: # items[curIndex].created>dateValue
-                    curIndex -= inc
-
-
-                count += 1
-
-            retVal = curIndex
-
-        return retVal
+        '''
+        First and last index of rows with created in [dateValues[0],dateValues[1]], [-1,-1] if none
+        Rows must be ordered by created
+        '''
+        created = self.getCreatedEpoch()
+        if dateValues[0] == dateValues[1]:
+            return [-1, -1]
+        start = int(numpy.searchsorted(created,dateValues[0],'left'))
+        end = int(numpy.searchsorted(created,dateValues[1],'right'))-1
+        if end < start:
+            return [-1, -1]
+        return [start, end]
 
 
 
@@ -230,6 +195,12 @@ class TimelineMap(MapQt):
 
         self.isPainting = False
 
+        # called with (min_dt,max_dt) when an anim layer extends its data date range
+        self.dateRangeCallback = None
+
+    def setDateRangeCallback(self,callback):
+        self.dateRangeCallback = callback
+
     def addAnimLayer(self,layer):
         self.animLayers.append(layer)
 
@@ -287,6 +258,13 @@ class TimelineDialog(MapDialog):
     def setDataDateRange(self,min_dt,max_dt):
         self.dataMinDate = min_dt
         self.dataMaxDate = max_dt
+        if hasattr(self,'dataDateLabel'):
+            # extend timeline edits to the new data range
+            self.dataDateLabel.setText(self.dataMinDate.strftime('%Y/%m/%d')+" - "+self.dataMaxDate.strftime('%Y/%m/%d'))
+            qdtmin = self.dt2qdt(self.dataMinDate)
+            qdtmax = self.dt2qdt(self.dataMaxDate)
+            for edit in (self.minDateEdit,self.maxDateEdit,self.viewMinDateEdit,self.viewMaxDateEdit):
+                edit.setDateTimeRange(qdtmin,qdtmax)
 
     def addTimeline(self,options,dataMinDate=None,dataMaxDate=None):
 
@@ -308,6 +286,7 @@ class TimelineDialog(MapDialog):
         self.dataDateLabel = QLabel()
         self.dataDateLabel.setText(self.dataMinDate.strftime('%Y/%m/%d')+" - "+self.dataMaxDate.strftime('%Y/%m/%d'))
         self.form_layout.addRow('Data Dates:',self.dataDateLabel)
+        self.view.setDateRangeCallback(self.setDataDateRange)
 
 
 
@@ -3,6 +3,7 @@ Utility functions
 '''
 
 from datetime import datetime, tzinfo, timedelta
+import calendar
 import numpy
 
 TIMEDELTA_ZERO = timedelta(0)
@@ -23,6 +24,8 @@ class UTC(tzinfo):
 class Utils(object):
     ''' Date and interpolation helper functions '''
     SECS_IN_DAY = 86400
+    # character widths of strptime directives used by fixed layout date formats
+    FIXED_DIRECTIVES = {'Y':4,'m':2,'d':2,'H':2,'M':2,'S':2}
 
     @staticmethod
     def str2utc(utcStr,format='%Y-%m-%d %H:%M:%S'):
@@ -39,6 +42,107 @@ class Utils(object):
         utc = utc.replace(tzinfo=from_zone)
         return utc
 
+    @staticmethod
+    def epoch2utc(secs):
+        ''' Epoch seconds to UTC datetime '''
+        utc = datetime.utcfromtimestamp(secs)
+        utc = utc.replace(tzinfo=UTC())
+        return utc
+
+    @staticmethod
+    def utc2epoch(dt):
+        ''' Datetime to epoch seconds, naive datetimes are treated as UTC '''
+        return calendar.timegm(dt.utctimetuple())
+
+    @staticmethod
+    def fixedFormatLayout(format):
+        '''
+        Character layout of fixed width date formats such as '%Y%m%d%H%M%S' or '%Y-%m-%d %H:%M:%S'
+        :return: [(directive,start,width)], [(literal,position)], total width or None if not fixed width
+        '''
+        fields = []
+        literals = []
+        pos = 0
+        i = 0
+        while i<len(format):
+            c = format[i]
+            if c=='%':
+                if i+1==len(format) or not format[i+1] in Utils.FIXED_DIRECTIVES:
+                    return None
+                width = Utils.FIXED_DIRECTIVES[format[i+1]]
+                fields.append((format[i+1],pos,width))
+                pos += width
+                i += 2
+            else:
+                literals.append((c,pos))
+                pos += 1
+                i += 1
+        return fields,literals,pos
+
+    @staticmethod
+    def strs2epoch(strs,format='%Y-%m-%d %H:%M:%S'):
+        '''
+        Parse a column of date strings to int64 epoch seconds.
+        Fixed width formats are parsed by slicing digit columns of the byte array,
+        strings that do not match the layout fall back to strptime.
+        Empty and '0' strings default to now
+        '''
+        strs = numpy.asarray(strs)
+        n = len(strs)
+        epoch = numpy.zeros(n,dtype=numpy.int64)
+        parsed = numpy.zeros(n,dtype=bool)
+
+        layout = Utils.fixedFormatLayout(format)
+        if n>0 and layout and strs.dtype.kind=='S' and strs.dtype.itemsize>=layout[2]:
+            fields,literals,width = layout
+            chars = numpy.ascontiguousarray(strs).view(numpy.uint8).reshape(n,strs.dtype.itemsize)
+            chars = chars.astype(numpy.int64)
+
+            # strings must be exactly width characters long with literals in place
+            parsed[:] = True
+            if strs.dtype.itemsize>width:
+                parsed &= chars[:,width]==0
+            for c,p in literals:
+                parsed &= chars[:,p]==ord(c)
+
+            values = {'Y':1900,'m':1,'d':1,'H':0,'M':0,'S':0}
+            for d,start,w in fields:
+                digits = chars[:,start:start+w]-ord('0')
+                parsed &= numpy.all((digits>=0) & (digits<=9),axis=1)
+                value = numpy.zeros(n,dtype=numpy.int64)
+                for k in range(0,w):
+                    value = value*10+digits[:,k]
+                values[d] = value
+
+            Y,m,d = values['Y'],values['m'],values['d']
+            H,M,S = values['H'],values['M'],values['S']
+
+            # days in month, with leap years, to reject dates strptime would reject
+            leap = ((Y%4==0) & (Y%100!=0)) | (Y%400==0)
+            monthDays = numpy.array([31,28,31,30,31,30,31,31,30,31,30,31],dtype=numpy.int64)
+            mIdx = numpy.clip(m-1,0,11)
+            maxDay = monthDays[mIdx]+((mIdx==1) & leap)
+            parsed &= (m>=1) & (m<=12) & (d>=1) & (d<=maxDay) & (H<24) & (M<60) & (S<=61)
+
+            # days since epoch from civil date
+            y = Y-(m<=2)
+            era = numpy.floor_divide(y,400)
+            yoe = y-era*400
+            doy = (153*((m+9)%12)+2)//5+d-1
+            doe = yoe*365+yoe//4-yoe//100+doy
+            days = era*146097+doe-719468
+            epoch[:] = days*Utils.SECS_IN_DAY+H*3600+M*60+S
+
+        # strptime fallback
+        for i in numpy.flatnonzero(~parsed):
+            val = strs[i]
+            if val=='' or val=='0':
+                epoch[i] = Utils.utc2epoch(datetime.now())
+            else:
+                epoch[i] = Utils.utc2epoch(Utils.str2utc(val,format))
+
+        return epoch
+
     @staticmethod
     def utc2str(dt):
         return dt.strftime('%Y-%m-%d %H:%M:%S')
@@ -0,0 +1,82 @@
+'''
+Speed of geo_qt.fast_projection against pyproj
+
+Times FastTransform and the pyproj path of MapUtils.transformArrays forward and inverse at a
+few array sizes, best of 3 runs. Without PySide, map_utils cannot be imported and pyproj is
+called as MapUtils.getTransformer does.
+
+python tests/benchmark_fast_projection.py
+
+'''
+
+import os
+import sys
+import time
+
+import numpy
+import pyproj
+
+sys.path.insert(0,os.path.join(os.path.dirname(os.path.abspath(__file__)),'..','geo_qt'))
+from fast_projection import FastTransform
+
+try:
+    from map_utils import MapUtils
+except ImportError:
+    MapUtils = None
+
+PROJS = [
+    '+init=epsg:3857',
+    '+proj=laea +lat_0=52 +lon_0=10 +x_0=4321000 +y_0=3210000 +ellps=GRS80 +units=m +no_defs',
+    '+proj=laea +lat_0=90 +lon_0=-40 +x_0=0 +y_0=0 +ellps=WGS84 +datum=WGS84 +units=m +no_defs'
+]
+
+SIZES = [10000,100000,1000000]
+
+
+def pyprojTransform(projSrc,projDest):
+    ''' Function projecting x,y arrays with pyproj, no FastTransform '''
+    if MapUtils!=None:
+        return lambda x,y: MapUtils.transformArrays(projSrc,projDest,x,y,())
+    if hasattr(pyproj,'Transformer'):
+        return pyproj.Transformer.from_proj(projSrc,projDest,always_xy=True).transform
+    return lambda x,y: pyproj.transform(projSrc,projDest,x,y)
+
+
+def timeCall(fn,*args):
+    ''' Best of 3 seconds and result of fn(*args) '''
+    secs = []
+    for i in range(0,3):
+        t0 = time.time()
+        result = fn(*args)
+        secs.append(time.time()-t0)
+    return min(secs),result
+
+
+def main():
+    numpy.random.seed(1)
+    epsg4326 = pyproj.Proj('+init=epsg:4326')
+    print('pyproj path: '+('MapUtils.transformArrays' if MapUtils!=None else 'pyproj, PySide not installed'))
+    for projStr in PROJS:
+        proj = pyproj.Proj(projStr)
+        forward = FastTransform.get(epsg4326,proj,('merc','laea'))
+        inverse = FastTransform.get(proj,epsg4326,('merc','laea'))
+        pyprojForward = pyprojTransform(epsg4326,proj)
+        pyprojInverse = pyprojTransform(proj,epsg4326)
+        print(projStr)
+        for n in SIZES:
+            lng = numpy.random.uniform(-180,180,n)
+            lat = numpy.random.uniform(-85,85,n)
+            pyprojSecs,(px,py) = timeCall(pyprojForward,lng,lat)
+            fastSecs = timeCall(forward,lng,lat)[0]
+            valid = numpy.isfinite(px) & numpy.isfinite(py)
+            px = numpy.asarray(px)[valid]
+            py = numpy.asarray(py)[valid]
+            pyprojInverseSecs = timeCall(pyprojInverse,px,py)[0]
+            fastInverseSecs = timeCall(inverse,px,py)[0]
+            print('  %8d points  forward pyproj %.4fs fast %.4fs %.1fx  inverse pyproj %.4fs fast %.4fs %.1fx' %
+                  (n,pyprojSecs,fastSecs,pyprojSecs/fastSecs,
+                   pyprojInverseSecs,fastInverseSecs,pyprojInverseSecs/fastInverseSecs))
+
+
+if __name__ == '__main__':
+    main()
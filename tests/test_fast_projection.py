@@ -0,0 +1,95 @@
+'''
+Accuracy of geo_qt.fast_projection against pyproj
+
+fast_projection is imported from the geo_qt directory, not as part of the geo_qt package,
+so the tests run without PySide:
+
+python -m unittest discover tests
+
+'''
+
+import os
+import sys
+import unittest
+
+import numpy
+import pyproj
+
+sys.path.insert(0,os.path.join(os.path.dirname(os.path.abspath(__file__)),'..','geo_qt'))
+from fast_projection import FastTransform, DEFAULT_PROJECTIONS
+
+PROJS = [
+    '+init=epsg:3857',
+    '+proj=merc +a=6378137 +b=6378137 +lat_ts=0.0 +lon_0=0.0 +x_0=0.0 +y_0=0 +k=1.0 +units=m +nadgrids=@null +wktext +no_defs',
+    '+proj=laea +lat_0=37.7624 +lon_0=136.881  +ellps=WGS84 +datum=WGS84 +units=m +no_defs',
+    '+proj=laea +lat_0=90 +lon_0=-40 +x_0=0 +y_0=0 +ellps=WGS84 +datum=WGS84 +units=m +no_defs',
+    '+proj=laea +lat_0=-90 +lon_0=0 +ellps=WGS84',
+    '+proj=laea +lat_0=0 +lon_0=20 +x_0=1000 +y_0=-500 +R=6371000',
+    '+proj=laea +lat_0=52 +lon_0=10 +x_0=4321000 +y_0=3210000 +ellps=GRS80 +units=m +no_defs'
+]
+
+# max forward error in m and inverse error in degrees
+FORWARD_TOLERANCE = 1e-3
+INVERSE_TOLERANCE = 1e-8
+
+
+def pyprojTransform(projSrc,projDest,x,y):
+    ''' Reference transform, pyproj>=2 Transformer or pyproj.transform '''
+    if hasattr(pyproj,'Transformer'):
+        return pyproj.Transformer.from_proj(projSrc,projDest,always_xy=True).transform(x,y)
+    return pyproj.transform(projSrc,projDest,x,y)
+
+
+class FastProjectionTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        numpy.random.seed(1)
+        n = 100000
+        cls.lng = numpy.random.uniform(-180,180,n)
+        cls.lat = numpy.random.uniform(-85,85,n)
+        cls.epsg4326 = pyproj.Proj('+init=epsg:4326')
+
+    def checkAccuracy(self,projStr):
+        proj = pyproj.Proj(projStr)
+        forward = FastTransform.get(self.epsg4326,proj,('merc','laea'))
+        inverse = FastTransform.get(proj,self.epsg4326,('merc','laea'))
+        self.assertTrue(forward and inverse,'No fast path for '+projStr)
+
+        px,py = pyprojTransform(self.epsg4326,proj,self.lng,self.lat)
+        px = numpy.asarray(px)
+        py = numpy.asarray(py)
+        fx,fy = forward(self.lng,self.lat)
+
+        # points outside the projection domain are nan in both
+        self.assertEqual((numpy.isfinite(px)!=numpy.isfinite(fx)).sum(),0,projStr)
+        valid = numpy.isfinite(px) & numpy.isfinite(py) & numpy.isfinite(fx)
+        forwardErr = max(numpy.abs(fx-px)[valid].max(),numpy.abs(fy-py)[valid].max())
+        self.assertLess(forwardErr,FORWARD_TOLERANCE,projStr)
+
+        ilng,ilat = pyprojTransform(proj,self.epsg4326,px[valid],py[valid])
+        flng,flat = inverse(px[valid],py[valid])
+        dlng = numpy.abs(flng-numpy.asarray(ilng))
+        dlng = numpy.minimum(dlng,360-dlng)
+        inverseErr = max(dlng.max(),numpy.abs(flat-numpy.asarray(ilat)).max())
+        self.assertLess(inverseErr,INVERSE_TOLERANCE,projStr)
+
+    def testAccuracy(self):
+        for projStr in PROJS:
+            self.checkAccuracy(projStr)
+
+    def testDefaultProjections(self):
+        ''' LAEA is only used when enabled '''
+        self.assertEqual(DEFAULT_PROJECTIONS,('merc',))
+        for projStr in PROJS:
+            proj = pyproj.Proj(projStr)
+            enabled = FastTransform.get(self.epsg4326,proj)!=None
+            self.assertEqual(enabled,not '+proj=laea' in projStr,projStr)
+
+    def testUnsupported(self):
+        proj = pyproj.Proj('+proj=utm +zone=33 +ellps=WGS84')
+        self.assertEqual(FastTransform.get(self.epsg4326,proj,('merc','laea')),None)
+
+
+if __name__ == '__main__':
+    unittest.main()